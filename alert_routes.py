@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from typing import List, Optional
+from pydantic import BaseModel, root_validator
+from auth import get_current_user
+from firebase_auth import verify_firebase_token
+from alerts import engine, check_webhook_url, RULE_KINDS, OPERATORS, INDICATORS
+from market_data import INTERVAL_MS, get_all_futures_symbols
+
+class AlertRule(BaseModel):
+    symbol: str
+    interval: str = "1h"
+    kind: str  # indicator | trend | pattern | level
+    indicator: Optional[str] = None  # kind=indicator
+    operator: Optional[str] = None  # <, >, crosses_above, crosses_below
+    value: Optional[float] = None
+    trend: Optional[str] = None  # kind=trend: tendencia destino (opcional)
+    pattern: Optional[str] = None  # kind=pattern: nombre del patrón (opcional)
+    direction: Optional[str] = None  # pattern: bullish|bearish, level: up|down
+    webhook_url: Optional[str] = None
+    once: bool = False
+
+    @root_validator
+    def check_rule(cls, values):
+        kind = values.get("kind")
+        if values.get("interval") not in INTERVAL_MS:
+            raise ValueError(f"interval debe ser uno de {tuple(INTERVAL_MS)}")
+        if kind not in RULE_KINDS:
+            raise ValueError(f"kind debe ser uno de {RULE_KINDS}")
+        if kind == "indicator":
+            if values.get("indicator") not in INDICATORS:
+                raise ValueError(f"indicator debe ser uno de {INDICATORS}")
+            if values.get("operator") not in OPERATORS:
+                raise ValueError(f"operator debe ser uno de {OPERATORS}")
+            if values.get("value") is None:
+                raise ValueError("value es obligatorio para alertas de indicador")
+        if kind == "pattern" and values.get("direction") not in (None, "bullish", "bearish"):
+            raise ValueError("direction debe ser bullish o bearish")
+        if kind == "level" and values.get("direction") not in (None, "up", "down"):
+            raise ValueError("direction debe ser up o down")
+        if values.get("symbol"):
+            values["symbol"] = values["symbol"].upper()
+        return values
+
+router = APIRouter()
+
+def get_user_id(current_user: dict) -> str:
+    return current_user.get('user_id') or current_user.get('uid')
+
+@router.get("/alerts")
+async def list_alerts(current_user: dict = Depends(get_current_user)):
+    return engine.list_rules(get_user_id(current_user))
+
+@router.post("/alerts")
+def create_alert(rule: AlertRule, current_user: dict = Depends(get_current_user)):
+    # Las comprobaciones con red (registro de símbolos, DNS del webhook) van
+    # aquí y no en el validador: la ruta síncrona corre en el threadpool
+    symbols = get_all_futures_symbols()
+    if not symbols:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="No se pudo obtener la lista de símbolos")
+    try:
+        if rule.symbol not in symbols:
+            raise ValueError(f"Símbolo desconocido: {rule.symbol}")
+        if rule.webhook_url:
+            check_webhook_url(rule.webhook_url)
+        return engine.add_rule(get_user_id(current_user), rule.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.delete("/alerts/{rule_id}")
+async def delete_alert(rule_id: str, current_user: dict = Depends(get_current_user)):
+    if not engine.remove_rule(get_user_id(current_user), rule_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alert not found")
+    return {"message": "Alert deleted successfully"}
+
+@router.websocket("/ws/alerts")
+async def alerts_socket(websocket: WebSocket, token: str):
+    # Los navegadores no envían cabeceras en WebSocket: el token va en la query
+    try:
+        user_id = get_user_id(verify_firebase_token(token))
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    events = engine.subscribe(user_id)
+    try:
+        while True:
+            await websocket.send_json(await events.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        engine.unsubscribe(user_id, events)
@@ -0,0 +1,401 @@
+"""
+Motor de alertas del lado del servidor.
+
+Las reglas se indexan por (símbolo, intervalo). Un hilo en segundo plano
+detecta el cierre de cada vela y, una sola vez por clave, calcula los
+indicadores, patrones y niveles que necesitan las reglas de esa clave; luego
+evalúa cada regla con búsquedas O(1) sobre ese snapshot. El coste lo marca
+el número de claves, no el de reglas: calcular el snapshot de una clave con
+niveles lleva decenas de ms, así que las claves pendientes se evalúan en
+ALERTS_EVAL_WORKERS hilos. Los disparos se entregan por webhook o a las
+conexiones WebSocket abiertas del usuario.
+"""
+import asyncio
+import ipaddress
+import logging
+import queue
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from config import get_settings
+from market_data import INTERVAL_MS, fetch_klines_many, now_ms as current_ms
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+RULE_KINDS = ("indicator", "trend", "pattern", "level")
+OPERATORS = ("<", ">", "crosses_above", "crosses_below")
+INDICATORS = (
+    "price", "rsi", "ema21", "ema50", "ema200", "macd", "macd_signal",
+    "macd_hist", "bb_upper", "bb_middle", "bb_lower", "atr",
+)
+
+
+def check_webhook_url(url: str) -> None:
+    """
+    Solo se aceptan webhooks https cuyo host resuelva a direcciones públicas,
+    para que el servidor no haga peticiones a su red interna o a metadatos.
+    Lanza ValueError si la URL no es válida.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme != "https" or not parsed.hostname:
+        raise ValueError("webhook_url debe ser una URL https")
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or 443, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError("No se pudo resolver el host de webhook_url")
+    for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError("webhook_url no puede apuntar a direcciones privadas o locales")
+
+
+def _indicator_snapshot(analysis: Dict) -> Dict[str, float]:
+    """Aplana la salida de calculate_indicators en {indicador: valor}"""
+    indicators = analysis["indicators"]
+    return {
+        "price": analysis["price"]["value"],
+        "rsi": indicators["rsi"]["value"],
+        "ema21": indicators["ema"]["ema21"],
+        "ema50": indicators["ema"]["ema50"],
+        "ema200": indicators["ema"]["ema200"],
+        "macd": indicators["macd"]["macd"],
+        "macd_signal": indicators["macd"]["signal"],
+        "macd_hist": indicators["macd"]["histogram"],
+        "bb_upper": indicators["bollinger_bands"]["upper"],
+        "bb_middle": indicators["bollinger_bands"]["middle"],
+        "bb_lower": indicators["bollinger_bands"]["lower"],
+        "atr": indicators["atr"],
+    }
+
+
+class AlertEngine:
+    """Almacén de reglas indexado por (símbolo, intervalo) y evaluador por cierre de vela"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules: Dict[str, Dict] = {}
+        self._by_key: Dict[Tuple[str, str], Dict[str, Dict]] = {}
+        self._by_user: Dict[str, Dict[str, Dict]] = {}
+        # Estado de la regla en el último cierre (para disparar solo en flancos)
+        self._rule_state: Dict[str, bool] = {}
+        # Snapshot del último cierre evaluado por clave
+        self._snapshots: Dict[Tuple[str, str], Dict] = {}
+        self._last_closed: Dict[Tuple[str, str], int] = {}
+        self._next_check: Dict[Tuple[str, str], int] = {}
+        # Descargas fallidas seguidas por clave (para espaciar los reintentos)
+        self._failures: Dict[Tuple[str, str], int] = {}
+
+        self._deliveries: "queue.Queue[Dict]" = queue.Queue(maxsize=settings.ALERTS_QUEUE_SIZE)
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._started = False
+
+    # --- Gestión de reglas ---
+
+    def add_rule(self, user_id: str, rule: Dict) -> Dict:
+        with self._lock:
+            if len(self._by_user.get(user_id, {})) >= settings.ALERTS_MAX_RULES_PER_USER:
+                raise ValueError("Se alcanzó el máximo de alertas por usuario")
+
+            rule = dict(rule, id=str(uuid.uuid4()), user_id=user_id, created_at=int(time.time() * 1000))
+            key = (rule["symbol"], rule["interval"])
+            self._rules[rule["id"]] = rule
+            self._by_key.setdefault(key, {})[rule["id"]] = rule
+            self._by_user.setdefault(user_id, {})[rule["id"]] = rule
+            self._next_check.setdefault(key, 0)
+        return rule
+
+    def remove_rule(self, user_id: str, rule_id: str) -> bool:
+        with self._lock:
+            rule = self._rules.get(rule_id)
+            if rule is None or rule["user_id"] != user_id:
+                return False
+            self._drop_rule(rule)
+        return True
+
+    def _drop_rule(self, rule: Dict) -> None:
+        key = (rule["symbol"], rule["interval"])
+        self._rules.pop(rule["id"], None)
+        self._rule_state.pop(rule["id"], None)
+        self._by_user.get(rule["user_id"], {}).pop(rule["id"], None)
+        bucket = self._by_key.get(key)
+        if bucket is not None:
+            bucket.pop(rule["id"], None)
+            if not bucket:
+                # Sin reglas para la clave: dejar de vigilarla
+                del self._by_key[key]
+                self._snapshots.pop(key, None)
+                self._last_closed.pop(key, None)
+                self._next_check.pop(key, None)
+                self._failures.pop(key, None)
+
+    def list_rules(self, user_id: str) -> List[Dict]:
+        with self._lock:
+            return list(self._by_user.get(user_id, {}).values())
+
+    # --- Evaluación ---
+
+    def _build_snapshot(self, key: Tuple[str, str], klines: List, rules: List[Dict]) -> Dict:
+        """Calcula solo lo que necesitan las reglas de la clave"""
+        from analysis import (
+            calculate_indicators, detect_candlestick_patterns, find_key_levels,
+            get_levels_period, klines_to_dataframe,
+        )
+
+        kinds = {rule["kind"] for rule in rules}
+        snapshot: Dict = {"close": float(klines[-1][4]), "time": klines[-1][0]}
+
+        if "indicator" in kinds or "trend" in kinds:
+            analysis = calculate_indicators(klines)
+            snapshot["indicators"] = _indicator_snapshot(analysis)
+            snapshot["trend"] = analysis["trend"]
+
+        if "pattern" in kinds or "level" in kinds:
+            df = klines_to_dataframe(klines)
+            if "pattern" in kinds:
+                last_time = df.index[-1]
+                snapshot["patterns"] = [
+                    p for p in detect_candlestick_patterns(df) if p["time"] == last_time
+                ]
+            if "level" in kinds:
+                # Niveles calculados sin la última vela, para detectar su ruptura
+                snapshot["levels"] = find_key_levels(df.iloc[:-1], get_levels_period(key[1]))
+
+        return snapshot
+
+    def _check_rule(self, rule: Dict, snapshot: Dict, previous: Optional[Dict]) -> Optional[str]:
+        """Devuelve el mensaje de disparo si la condición de la regla se cumple"""
+        kind = rule["kind"]
+
+        if kind == "indicator":
+            name, op, value = rule["indicator"], rule["operator"], rule["value"]
+            current = snapshot["indicators"].get(name)
+            if current is None:
+                return None
+            if op == "<" and current < value:
+                return f"{name} {current} < {value}"
+            if op == ">" and current > value:
+                return f"{name} {current} > {value}"
+            if op in ("crosses_above", "crosses_below"):
+                if not previous or "indicators" not in previous:
+                    return None
+                before = previous["indicators"].get(name)
+                if before is None:
+                    return None
+                if op == "crosses_above" and before <= value < current:
+                    return f"{name} cruzó por encima de {value} ({current})"
+                if op == "crosses_below" and before >= value > current:
+                    return f"{name} cruzó por debajo de {value} ({current})"
+            return None
+
+        if kind == "trend":
+            if not previous or previous.get("trend") is None:
+                return None
+            before, current = previous["trend"], snapshot["trend"]
+            if before != current and rule.get("trend") in (None, current):
+                return f"Tendencia cambió de {before} a {current}"
+            return None
+
+        if kind == "pattern":
+            for pattern in snapshot["patterns"]:
+                if rule.get("pattern") not in (None, pattern["name"]):
+                    continue
+                if rule.get("direction") not in (None, pattern["type"]):
+                    continue
+                return f"Patrón {pattern['name']} ({pattern['type']})"
+            return None
+
+        if kind == "level":
+            if not previous:
+                return None
+            before, current = previous["close"], snapshot["close"]
+            for level in snapshot["levels"]:
+                price = level["price"]
+                if rule.get("direction") in (None, "up") and before <= price < current:
+                    return f"Ruptura alcista del nivel {level['type']} {price}"
+                if rule.get("direction") in (None, "down") and before >= price > current:
+                    return f"Ruptura bajista del nivel {level['type']} {price}"
+            return None
+
+        return None
+
+    def evaluate(self, key: Tuple[str, str], klines: List) -> List[Dict]:
+        """
+        Evalúa las reglas de `key` sobre velas cerradas y entrega los disparos
+        """
+        with self._lock:
+            rules = list(self._by_key.get(key, {}).values())
+        if not rules or not klines:
+            return []
+
+        snapshot = self._build_snapshot(key, klines, rules)
+        previous = self._snapshots.get(key)
+        self._snapshots[key] = snapshot
+
+        events = []
+        for rule in rules:
+            try:
+                message = self._check_rule(rule, snapshot, previous)
+            except Exception as e:
+                logger.error(f"Error evaluating alert {rule['id']}: {e}")
+                continue
+
+            # Las condiciones de umbral (< y >) solo disparan en el flanco de subida;
+            # cruces, cambios de tendencia, patrones y rupturas ya son eventos
+            if rule["kind"] == "indicator" and rule["operator"] in ("<", ">"):
+                was_active = self._rule_state.get(rule["id"], False)
+                self._rule_state[rule["id"]] = message is not None
+                if was_active:
+                    continue
+            if message is None:
+                continue
+
+            events.append({
+                "rule_id": rule["id"],
+                "user_id": rule["user_id"],
+                "symbol": key[0],
+                "interval": key[1],
+                "kind": rule["kind"],
+                "message": message,
+                "candle_time": snapshot["time"],
+                "triggered_at": int(time.time() * 1000),
+            })
+            if rule.get("once"):
+                with self._lock:
+                    self._drop_rule(rule)
+
+        for event in events:
+            self._dispatch(event)
+        return events
+
+    def poll(self) -> None:
+        """Evalúa las claves cuya vela debería haber cerrado desde la última revisión"""
+        now_ms = current_ms()
+        with self._lock:
+            due = [key for key, at in self._next_check.items() if at <= now_ms and key[1] in INTERVAL_MS]
+
+        by_interval: Dict[str, List[str]] = {}
+        for symbol, interval in due:
+            by_interval.setdefault(interval, []).append(symbol)
+
+        ready: List[Tuple[Tuple[str, str], List]] = []
+        for interval, symbols in by_interval.items():
+            interval_ms = INTERVAL_MS[interval]
+            klines_by_symbol = fetch_klines_many(symbols, interval, limit=settings.ALERTS_KLINES_LIMIT)
+
+            for symbol in symbols:
+                key = (symbol, interval)
+                if symbol not in klines_by_symbol:
+                    self._back_off(key, now_ms)
+                    continue
+                closed = [k for k in klines_by_symbol[symbol] if k[6] < now_ms]
+                if not closed or self._last_closed.get(key) == closed[-1][0]:
+                    # La vela aún no aparece cerrada: reintentar en el próximo ciclo
+                    continue
+
+                with self._lock:
+                    if key not in self._next_check:
+                        # Se borraron todas sus reglas mientras se descargaba
+                        continue
+                    self._failures.pop(key, None)
+                    self._last_closed[key] = closed[-1][0]
+                    self._next_check[key] = closed[-1][0] + 2 * interval_ms
+                ready.append((key, closed))
+
+        with ThreadPoolExecutor(max_workers=settings.ALERTS_EVAL_WORKERS) as executor:
+            executor.map(lambda item: self._evaluate_safely(*item), ready)
+
+    def _evaluate_safely(self, key: Tuple[str, str], klines: List) -> None:
+        try:
+            self.evaluate(key, klines)
+        except Exception as e:
+            logger.error(f"Error evaluating alerts for {key[0]} {key[1]}: {e}")
+
+    def _back_off(self, key: Tuple[str, str], now_ms: int) -> None:
+        """Tras una descarga fallida, espera el doble que la vez anterior (hasta ALERTS_MAX_BACKOFF_SECONDS)"""
+        with self._lock:
+            if key not in self._next_check:
+                return
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            delay = min(settings.ALERTS_POLL_SECONDS * 2 ** failures, settings.ALERTS_MAX_BACKOFF_SECONDS)
+            self._next_check[key] = now_ms + delay * 1000
+
+    # --- Entrega ---
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        """Registra una conexión WebSocket del usuario (llamar desde el event loop)"""
+        events: asyncio.Queue = asyncio.Queue(maxsize=settings.ALERTS_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append((asyncio.get_running_loop(), events))
+        return events
+
+    def unsubscribe(self, user_id: str, events: asyncio.Queue) -> None:
+        with self._lock:
+            remaining = [s for s in self._subscribers.get(user_id, []) if s[1] is not events]
+            if remaining:
+                self._subscribers[user_id] = remaining
+            else:
+                self._subscribers.pop(user_id, None)
+
+    def _dispatch(self, event: Dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(event["user_id"], []))
+            webhook_url = self._rules.get(event["rule_id"], {}).get("webhook_url")
+
+        for loop, events in subscribers:
+            loop.call_soon_threadsafe(self._put_nowait, events, event)
+
+        if webhook_url:
+            try:
+                self._deliveries.put_nowait(dict(event, webhook_url=webhook_url))
+            except queue.Full:
+                logger.error(f"Alert delivery queue full, dropping {event['rule_id']}")
+
+    @staticmethod
+    def _put_nowait(events: asyncio.Queue, event: Dict) -> None:
+        try:
+            events.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.error(f"WebSocket alert queue full, dropping {event['rule_id']}")
+
+    def _deliver_webhooks(self) -> None:
+        import requests
+
+        while True:
+            event = self._deliveries.get()
+            url = event.pop("webhook_url")
+            try:
+                # Se vuelve a comprobar al entregar: el DNS puede haber cambiado
+                check_webhook_url(url)
+                requests.post(url, json=event, timeout=settings.ALERTS_WEBHOOK_TIMEOUT,
+                              allow_redirects=False)
+            except ValueError as e:
+                logger.error(f"Refusing webhook for alert {event['rule_id']}: {e}")
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error delivering alert {event['rule_id']} to webhook: {e}")
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error in alert loop: {e}")
+            time.sleep(settings.ALERTS_POLL_SECONDS)
+
+    def start(self) -> None:
+        """Arranca el bucle de evaluación y ALERTS_WEBHOOK_WORKERS hilos de entrega"""
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._run, name="alerts-engine", daemon=True).start()
+        for i in range(settings.ALERTS_WEBHOOK_WORKERS):
+            threading.Thread(target=self._deliver_webhooks, name=f"alerts-webhooks-{i}", daemon=True).start()
+
+
+engine = AlertEngine()
@@ -6,6 +6,36 @@ from typing import List, Dict
 
 logger = logging.getLogger(__name__)
 
+KLINE_COLUMNS = [
+    'timestamp', 'open', 'high', 'low', 'close', 'volume',
+    'close_time', 'quote_volume', 'trades', 'taker_buy_base',
+    'taker_buy_quote', 'ignore'
+]
+
+def klines_to_dataframe(klines: List) -> pd.DataFrame:
+    """
+    Convierte velas crudas de Binance en un DataFrame indexado por timestamp
+    """
+    df = pd.DataFrame(klines, columns=KLINE_COLUMNS)
+
+    # Convertir columnas numéricas
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        df[col] = pd.to_numeric(df[col])
+
+    # Establecer timestamp como índice
+    df.set_index(pd.to_datetime(df['timestamp'], unit='ms'), inplace=True)
+    return df
+
+def get_levels_period(interval: str) -> int:
+    """
+    Período de la ventana de pivots según el intervalo
+    """
+    if interval in ['1m', '5m']:
+        return 10
+    elif interval in ['15m', '30m']:
+        return 15
+    return 20
+
 def calculate_indicators(klines: List) -> Dict:
     if not klines:
         raise HTTPException(status_code=500, detail="No se obtuvieron datos de klines de Binance")
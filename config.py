@@ -10,6 +10,74 @@ class Settings(BaseSettings):
     
     # Binance
     BINANCE_API_URL: str = "https://api.binance.com"
+
+    # Fuente de datos: "binance" o "replay" (datos grabados en REPLAY_DIR)
+    DATA_SOURCE: str = "binance"
+    REPLAY_DIR: str = "replay_data"
+    REPLAY_SPEED: float = 1.0  # 0 congela el reloj virtual
+    REPLAY_START: int = 0  # ms; 0 = cuando hay KLINES_CACHE_LIMIT velas grabadas
+
+    # Caché de datos de mercado
+    SYMBOLS_CACHE_TTL: int = 300  # segundos
+    KLINES_CACHE_TTL: int = 5  # segundos
+    KLINES_CACHE_LIMIT: int = 1000  # velas guardadas por (símbolo, intervalo)
+    KLINES_CACHE_MAX_ENTRIES: int = 120  # pares (símbolo, intervalo) en memoria (~0.8 MB cada uno)
+    KLINES_FETCH_WORKERS: int = 8  # descargas en paralelo para consultas multi-símbolo
+    KLINES_RANGE_MAX_CANDLES: int = 100000  # máximo por consulta con start/end
+    DOWNSAMPLE_CACHE_SIZE: int = 128  # series reducidas cacheadas
+    DOWNSAMPLE_MAX_POINTS: int = 5000  # máximo de max_points por petición
+    DOWNSAMPLE_HISTORY_CACHE_SIZE: int = 8  # historiales (símbolo, intervalo) para rangos sin end
+
+    # Precalentamiento al arrancar
+    WARMUP_ENABLED: bool = True
+    HOT_SYMBOLS: str = "BTCUSDT,ETHUSDT,BNBUSDT,SOLUSDT,XRPUSDT"  # separados por coma
+    WARMUP_INTERVALS: str = "1h"  # separados por coma
+
+    # Correlación entre símbolos
+    CORRELATION_MAX_SYMBOLS: int = 300
+    CORRELATION_BENCHMARK: str = "BTCUSDT"
+    CORRELATION_MAX_SERIES: int = 1500  # series de cierres guardadas (intervalo, símbolo)
+
+    # Alertas
+    ALERTS_ENABLED: bool = True
+    ALERTS_POLL_SECONDS: int = 5
+    ALERTS_KLINES_LIMIT: int = 300  # velas usadas para evaluar cada clave
+    ALERTS_MAX_RULES_PER_USER: int = 100
+    ALERTS_QUEUE_SIZE: int = 10000
+    ALERTS_WEBHOOK_TIMEOUT: int = 5  # segundos
+    ALERTS_WEBHOOK_WORKERS: int = 8  # hilos de entrega de webhooks
+    ALERTS_EVAL_WORKERS: int = 4  # claves evaluadas en paralelo
+    ALERTS_MAX_BACKOFF_SECONDS: int = 900  # espera máxima tras descargas fallidas
+
+    # Libros de órdenes
+    DEPTH_SYMBOLS: str = ""  # suscritos al arrancar, separados por coma
+    DEPTH_MAX_SUBSCRIPTIONS: int = 20
+    DEPTH_STREAM_SPEED: int = 500  # ms (100, 250 o 500)
+    DEPTH_MAX_LEVELS: int = 5000  # niveles guardados por lado
+    DEPTH_MAX_PENDING_EVENTS: int = 1000
+    DEPTH_RESYNC_DELAY: int = 1  # segundos
+    DEPTH_MAX_RESYNC_ATTEMPTS: int = 5  # después se descarta el libro
+    DEPTH_IDLE_SECONDS: int = 600  # sin consultas se cancela la suscripción
+    DEPTH_BUCKETS_PER_SIDE: int = 50
+
+    # Pipeline de indicadores
+    INDICATORS_KLINES_LIMIT: int = 500  # velas usadas para calcular
+    INDICATORS_MAX_PER_REQUEST: int = 20
+    INDICATORS_CACHE_SIZE: int = 256  # grafos memoizados
+
+    # Resumen de mercado
+    MARKET_OVERVIEW_ENABLED: bool = True
+    MARKET_OVERVIEW_REFRESH_SECONDS: int = 15
+    MARKET_OVERVIEW_TOP_N: int = 20
+
+    # Derivados (funding, open interest, long/short)
+    DERIVATIVES_ENABLED: bool = True
+    DERIVATIVES_TICK_SECONDS: int = 5
+    DERIVATIVES_PREMIUM_SECONDS: int = 60  # premiumIndex en bloque
+    DERIVATIVES_OPEN_INTEREST_PER_MINUTE: int = 300  # peticiones por minuto
+    DERIVATIVES_RATIO_PER_MINUTE: int = 120  # peticiones por minuto
+    DERIVATIVES_RATIO_PERIOD: str = "5m"
+    DERIVATIVES_HISTORY: int = 288  # muestras guardadas por serie
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,218 @@
+"""
+Análisis transversal entre símbolos: correlación de retornos, beta respecto
+al benchmark y ranking de fuerza relativa.
+
+Todas las series de cierre se alinean en una única matriz NumPy
+(símbolos x velas) y los cálculos se hacen vectorizados sobre ella. Los
+cierres de velas cerradas se guardan por (intervalo, símbolo) en arrays
+compactos, fuera de la caché de velas de market_data, y en cada recálculo
+solo se descargan las velas nuevas.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+from config import get_settings
+from market_data import (
+    INTERVAL_MS,
+    fetch_klines,
+    fetch_recent_klines,
+    get_all_futures_symbols,
+    now_ms as current_ms,
+)
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# (intervalo, ventana, símbolos) -> (open time de la última vela cerrada, resultado)
+_cache: Dict[Tuple, Tuple[int, Dict]] = {}
+_cache_lock = threading.Lock()
+_CACHE_MAX_ENTRIES = 64
+
+# (intervalo, símbolo) -> (open times, cierres) de velas cerradas
+_series: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+_series_lock = threading.Lock()
+
+
+def _closed_series(klines: List, now_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Open times y cierres de las velas ya cerradas"""
+    closed = [k for k in klines if k[6] < now_ms]
+    times = np.fromiter((k[0] for k in closed), dtype=np.int64, count=len(closed))
+    closes = np.fromiter((float(k[4]) for k in closed), dtype=np.float64, count=len(closed))
+    return times, closes
+
+
+def _update_series(symbol: str, interval: str, window: int,
+                   now_ms: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Cierres guardados de `symbol` completados con las velas cerradas desde el
+    último guardado. Devuelve None si la descarga falla.
+    """
+    key = (interval, symbol)
+    with _series_lock:
+        stored = _series.get(key)
+        if stored is not None:
+            _series.move_to_end(key)
+
+    limit = window + 2
+    interval_ms = INTERVAL_MS.get(interval)
+    if stored is not None and len(stored[0]) > window and interval_ms:
+        # Velas cerradas desde la última guardada, más la que sigue abierta
+        limit = min(limit, (now_ms - int(stored[0][-1])) // interval_ms + 1)
+        if limit <= 1:
+            return stored
+
+    try:
+        times, closes = _closed_series(fetch_recent_klines(symbol, interval, limit), now_ms)
+    except Exception as e:
+        logger.error(f"Error getting klines for {symbol}: {e}")
+        return None
+
+    if stored is not None and len(times):
+        keep = stored[0] < times[0]
+        times = np.concatenate([stored[0][keep], times])
+        closes = np.concatenate([stored[1][keep], closes])
+    series = (times[-settings.KLINES_CACHE_LIMIT:], closes[-settings.KLINES_CACHE_LIMIT:])
+
+    with _series_lock:
+        _series[key] = series
+        _series.move_to_end(key)
+        while len(_series) > settings.CORRELATION_MAX_SERIES:
+            _series.popitem(last=False)
+    return series
+
+
+def build_close_matrix(series: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                       reference: np.ndarray) -> Tuple[List[str], np.ndarray]:
+    """
+    Alinea los cierres de cada símbolo sobre los open times de `reference`.
+    Los huecos se rellenan con el último cierre conocido; las velas anteriores
+    al primer dato del símbolo quedan como NaN.
+    """
+    symbols = list(series.keys())
+    matrix = np.full((len(symbols), len(reference)), np.nan)
+
+    for row, symbol in enumerate(symbols):
+        times, closes = series[symbol]
+        idx = np.searchsorted(reference, times)
+        idx = np.minimum(idx, len(reference) - 1)
+        valid = reference[idx] == times
+        matrix[row, idx[valid]] = closes[valid]
+
+    # Forward fill por filas
+    positions = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[1]))
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    matrix = matrix[np.arange(matrix.shape[0])[:, None], positions]
+
+    return symbols, matrix
+
+
+def correlation_matrix(returns: np.ndarray) -> np.ndarray:
+    """Correlación de Pearson entre filas de una matriz de retornos"""
+    centered = returns - returns.mean(axis=1, keepdims=True)
+    std = centered.std(axis=1, keepdims=True)
+    std[std == 0] = np.nan
+    z = centered / std
+    corr = (z @ z.T) / returns.shape[1]
+    return np.clip(np.nan_to_num(corr), -1.0, 1.0)
+
+
+def beta_to(returns: np.ndarray, benchmark: np.ndarray) -> np.ndarray:
+    """Beta de cada fila respecto a la serie de retornos del benchmark"""
+    bench_centered = benchmark - benchmark.mean()
+    variance = np.mean(bench_centered ** 2)
+    if variance == 0:
+        return np.zeros(returns.shape[0])
+    centered = returns - returns.mean(axis=1, keepdims=True)
+    return (centered @ bench_centered) / returns.shape[1] / variance
+
+
+def compute_correlation(interval: str = "1h", window: int = 100,
+                        symbols: Optional[List[str]] = None) -> Dict:
+    """
+    Calcula correlaciones, betas y fuerza relativa sobre los últimos `window`
+    retornos de velas cerradas. El resultado se cachea hasta que cierra la
+    siguiente vela.
+    """
+    if window < 2 or window >= settings.KLINES_CACHE_LIMIT - 1:
+        raise HTTPException(status_code=400, detail=f"window debe estar entre 2 y {settings.KLINES_CACHE_LIMIT - 2}")
+
+    benchmark = settings.CORRELATION_BENCHMARK
+    universe = symbols if symbols else get_all_futures_symbols()
+    universe = [s for s in dict.fromkeys(universe) if s != benchmark]
+    universe = [benchmark] + universe[:settings.CORRELATION_MAX_SYMBOLS - 1]
+
+    now_ms = current_ms()
+
+    # El benchmark marca la última vela cerrada; si no ha cambiado, no se recalcula
+    try:
+        reference, _ = _closed_series(fetch_klines(benchmark, interval, limit=window + 2), now_ms)
+    except Exception as e:
+        logger.error(f"Error getting klines for benchmark {benchmark}: {e}")
+        raise HTTPException(status_code=503, detail=f"No se pudieron obtener velas de {benchmark}")
+    if len(reference) < window + 1:
+        raise HTTPException(status_code=404, detail="No hay suficientes velas cerradas para la ventana pedida")
+
+    last_closed = int(reference[-1])
+    cache_key = (interval, window, tuple(universe))
+    cached = _cache.get(cache_key)
+    if cached and cached[0] == last_closed:
+        return cached[1]
+
+    with ThreadPoolExecutor(max_workers=settings.KLINES_FETCH_WORKERS) as executor:
+        updated = executor.map(lambda symbol: (symbol, _update_series(symbol, interval, window, now_ms)), universe)
+        series = {symbol: data for symbol, data in updated if data is not None and len(data[0])}
+    if benchmark not in series:
+        raise HTTPException(status_code=503, detail=f"No se pudieron obtener velas de {benchmark}")
+    reference = series[benchmark][0][-(window + 1):]
+
+    names, matrix = build_close_matrix(series, reference)
+    matrix = matrix[:, -(window + 1):]
+
+    # Descartar símbolos sin historia completa en la ventana
+    complete = ~np.isnan(matrix).any(axis=1) & (matrix > 0).all(axis=1)
+    names = [name for name, keep in zip(names, complete) if keep]
+    matrix = matrix[complete]
+
+    returns = np.diff(np.log(matrix), axis=1)
+    bench_row = names.index(benchmark)
+
+    corr = correlation_matrix(returns)
+    betas = beta_to(returns, returns[bench_row])
+
+    period_return = matrix[:, -1] / matrix[:, 0] - 1
+    relative = period_return - period_return[bench_row]
+    order = np.argsort(-relative, kind="stable")
+    ranks = np.empty(len(names), dtype=np.int64)
+    ranks[order] = np.arange(1, len(names) + 1)
+
+    result = {
+        "interval": interval,
+        "window": window,
+        "as_of": last_closed,
+        "benchmark": benchmark,
+        "symbols": names,
+        "correlation": np.round(corr, 4).tolist(),
+        "beta": {name: round(float(b), 4) for name, b in zip(names, betas)},
+        "relative_strength": [
+            {
+                "symbol": names[i],
+                "return": round(float(period_return[i]), 6),
+                "relative_return": round(float(relative[i]), 6),
+                "rank": int(ranks[i]),
+            }
+            for i in order
+        ],
+    }
+
+    with _cache_lock:
+        if len(_cache) >= _CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[cache_key] = (last_closed, result)
+
+    return result
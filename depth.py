@@ -0,0 +1,443 @@
+"""
+Libros de órdenes locales para símbolos de futuros.
+
+Cada libro se construye con un snapshot REST (/fapi/v1/depth) y se mantiene
+con el stream diff-depth siguiendo las reglas de sincronización de Binance.
+Los niveles de cada lado se guardan en arrays NumPy ordenados por precio, de
+modo que aplicar una actualización y agregar en buckets son operaciones
+vectorizadas.
+
+Para reproducir un problema o probar el libro sin conexión, `replay` aplica
+un snapshot y una lista de eventos grabados (ver `load_recording`).
+"""
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import get_settings
+from market_data import get_futures_client, is_replay, split_setting
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class BookSide:
+    """Niveles de un lado del libro en arrays ordenados por precio ascendente"""
+
+    __slots__ = ("prices", "quantities")
+
+    def __init__(self):
+        self.prices = np.empty(0, dtype=np.float64)
+        self.quantities = np.empty(0, dtype=np.float64)
+
+    def load(self, levels: List) -> None:
+        data = np.asarray(levels, dtype=np.float64).reshape(-1, 2)
+        data = data[data[:, 1] > 0]
+        order = np.argsort(data[:, 0], kind="stable")
+        self.prices = data[order, 0]
+        self.quantities = data[order, 1]
+
+    def apply(self, levels: List) -> None:
+        """Aplica [[precio, cantidad], ...]; cantidad 0 elimina el nivel"""
+        if not levels:
+            return
+        data = np.asarray(levels, dtype=np.float64).reshape(-1, 2)
+
+        # Si un precio se repite en el mismo evento, gana la última actualización
+        prices, last = np.unique(data[::-1, 0], return_index=True)
+        quantities = data[::-1, 1][last]
+
+        idx = np.searchsorted(self.prices, prices)
+        if len(self.prices):
+            exists = (idx < len(self.prices)) & (self.prices[np.minimum(idx, len(self.prices) - 1)] == prices)
+        else:
+            exists = np.zeros(len(prices), dtype=bool)
+
+        self.quantities[idx[exists]] = quantities[exists]
+
+        new = ~exists & (quantities > 0)
+        if new.any():
+            self.prices = np.insert(self.prices, idx[new], prices[new])
+            self.quantities = np.insert(self.quantities, idx[new], quantities[new])
+
+        if (quantities[exists] == 0).any():
+            keep = self.quantities > 0
+            self.prices = self.prices[keep]
+            self.quantities = self.quantities[keep]
+
+    def trim(self, max_levels: int, keep_highest: bool) -> None:
+        if len(self.prices) <= max_levels:
+            return
+        window = slice(-max_levels, None) if keep_highest else slice(0, max_levels)
+        self.prices = self.prices[window]
+        self.quantities = self.quantities[window]
+
+
+class OrderBook:
+    """Libro de órdenes local de un símbolo"""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = BookSide()
+        self.asks = BookSide()
+        self.last_update_id: Optional[int] = None
+        self.updated_at: Optional[int] = None
+        # True cuando ya se aplicó el primer evento que enlaza con el snapshot
+        self.synced = False
+
+    def load_snapshot(self, snapshot: Dict) -> None:
+        self.bids.load(snapshot["bids"])
+        self.asks.load(snapshot["asks"])
+        self.last_update_id = snapshot["lastUpdateId"]
+        self.updated_at = snapshot.get("E") or snapshot.get("T")
+        self.synced = False
+
+    def apply_event(self, event: Dict) -> bool:
+        """
+        Aplica un evento depthUpdate. Devuelve False si hay un hueco en la
+        secuencia y el libro debe resincronizarse con un snapshot nuevo.
+        """
+        if self.last_update_id is None:
+            return False
+        if event["u"] < self.last_update_id:
+            # Evento anterior al snapshot
+            return True
+
+        if not self.synced:
+            if event["U"] > self.last_update_id:
+                return False
+            self.synced = True
+        elif "pu" in event:
+            # Futuros: cada evento referencia el final del anterior
+            if event["pu"] != self.last_update_id:
+                return False
+        elif event["U"] != self.last_update_id + 1:
+            return False
+
+        self.bids.apply(event["b"])
+        self.asks.apply(event["a"])
+        self.bids.trim(settings.DEPTH_MAX_LEVELS, keep_highest=True)
+        self.asks.trim(settings.DEPTH_MAX_LEVELS, keep_highest=False)
+        self.last_update_id = event["u"]
+        self.updated_at = event.get("E")
+        return True
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Copia de los arrays (precios/cantidades de bids y asks)"""
+        return (self.bids.prices.copy(), self.bids.quantities.copy(),
+                self.asks.prices.copy(), self.asks.quantities.copy())
+
+
+def replay(snapshot: Dict, events: List[Dict], symbol: str = "") -> OrderBook:
+    """Reconstruye un libro a partir de un snapshot y eventos grabados"""
+    book = OrderBook(symbol or snapshot.get("symbol", ""))
+    book.load_snapshot(snapshot)
+    for event in events:
+        if not book.apply_event(event):
+            raise ValueError(f"Hueco en la secuencia de depth en el evento u={event['u']}")
+    return book
+
+
+def load_recording(path: str) -> Tuple[Dict, List[Dict]]:
+    """Lee una grabación JSON Lines: primera línea snapshot, resto eventos depthUpdate"""
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    return lines[0], lines[1:]
+
+
+def _aggregate_side(prices: np.ndarray, quantities: np.ndarray,
+                    step: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Precio base, cantidad y nocional de cada bucket"""
+    keys = np.floor(prices / step)
+    buckets, inverse = np.unique(keys, return_inverse=True)
+    sizes = np.bincount(inverse, weights=quantities, minlength=len(buckets))
+    notional = np.bincount(inverse, weights=prices * quantities, minlength=len(buckets))
+    return buckets * step, sizes, notional
+
+
+def aggregate_depth(book: OrderBook, step: Optional[float] = None, range_pct: float = 2.0,
+                    wall_factor: float = 5.0) -> Dict:
+    """
+    Agrupa el libro en buckets de `step` dentro de ±`range_pct` % del precio
+    medio y marca como muros los buckets cuyo nocional supera `wall_factor`
+    veces la mediana.
+    """
+    bid_prices, bid_qty, ask_prices, ask_qty = book.view()
+    if not len(bid_prices) or not len(ask_prices):
+        raise ValueError(f"Libro vacío para {book.symbol}")
+
+    best_bid, best_ask = float(bid_prices[-1]), float(ask_prices[0])
+    mid = (best_bid + best_ask) / 2
+    if not step or step <= 0:
+        step = mid * range_pct / 100 / settings.DEPTH_BUCKETS_PER_SIDE
+
+    bid_mask = bid_prices >= mid * (1 - range_pct / 100)
+    ask_mask = ask_prices <= mid * (1 + range_pct / 100)
+    bid_buckets, bid_sizes, bid_notional = _aggregate_side(bid_prices[bid_mask], bid_qty[bid_mask], step)
+    ask_buckets, ask_sizes, ask_notional = _aggregate_side(ask_prices[ask_mask], ask_qty[ask_mask], step)
+
+    # Bids de mayor a menor precio, asks de menor a mayor
+    bid_buckets, bid_sizes, bid_notional = bid_buckets[::-1], bid_sizes[::-1], bid_notional[::-1]
+
+    all_notional = np.concatenate([bid_notional, ask_notional])
+    threshold = float(np.median(all_notional)) * wall_factor if len(all_notional) else 0.0
+
+    def _rows(buckets, sizes, notional):
+        return [
+            {"price": float(p), "quantity": float(q), "notional": round(float(n), 2)}
+            for p, q, n in zip(buckets, sizes, notional)
+        ]
+
+    walls = []
+    for side, buckets, sizes, notional in (("bid", bid_buckets, bid_sizes, bid_notional),
+                                           ("ask", ask_buckets, ask_sizes, ask_notional)):
+        for i in np.nonzero(notional >= threshold)[0] if threshold > 0 else []:
+            walls.append({
+                "side": side,
+                "price": float(buckets[i]),
+                "quantity": float(sizes[i]),
+                "notional": round(float(notional[i]), 2),
+                "ratio": round(float(notional[i]) / (threshold / wall_factor), 2),
+            })
+    walls.sort(key=lambda w: w["notional"], reverse=True)
+
+    return {
+        "symbol": book.symbol,
+        "updated_at": book.updated_at,
+        "best_bid": best_bid,
+        "best_ask": best_ask,
+        "mid": mid,
+        "step": step,
+        "bids": _rows(bid_buckets, bid_sizes, bid_notional),
+        "asks": _rows(ask_buckets, ask_sizes, ask_notional),
+        "walls": walls,
+    }
+
+
+def walls_as_levels(depth: Dict) -> List[Dict]:
+    """Convierte los muros al formato de find_key_levels"""
+    return [
+        {
+            "type": "support" if wall["side"] == "bid" else "resistance",
+            "price": wall["price"],
+            "strength": wall["notional"],
+            "touches": 0,
+            "source": "orderbook",
+        }
+        for wall in depth["walls"]
+    ]
+
+
+class DepthCapacityError(Exception):
+    """No quedan suscripciones libres (DEPTH_MAX_SUBSCRIPTIONS)"""
+
+
+def _is_client_error(error: Exception) -> bool:
+    """Errores 4xx de Binance (símbolo inexistente, parámetros inválidos)"""
+    status_code = getattr(error, "status_code", None)
+    return isinstance(status_code, int) and 400 <= status_code < 500
+
+
+class DepthManager:
+    """Mantiene los libros suscritos a partir del stream diff-depth de futuros"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books: Dict[str, OrderBook] = {}
+        # Eventos recibidos mientras se espera el snapshot (None = sincronizado)
+        self._pending: Dict[str, Optional[List[Dict]]] = {}
+        # Última consulta de cada libro, para cancelar los que nadie usa
+        self._last_access: Dict[str, float] = {}
+        self._ws = None
+
+    def _get_ws(self):
+        if self._ws is None:
+            from binance.websocket.um_futures.websocket_client import UMFuturesWebsocketClient
+            self._ws = UMFuturesWebsocketClient(on_message=self._on_message)
+            threading.Thread(target=self._evict_idle_loop, name="depth-idle", daemon=True).start()
+        return self._ws
+
+    def subscribe(self, symbol: str) -> Optional[Dict]:
+        """
+        Suscribe el libro de `symbol`. El snapshot se pide antes de registrar
+        el libro, de modo que un símbolo inexistente lanza ValueError sin
+        ocupar una suscripción. Devuelve ese snapshot (None si ya estaba
+        suscrito).
+        """
+        if is_replay():
+            raise ValueError("Los streams de depth no están disponibles en modo replay")
+        self.evict_idle()
+        with self._lock:
+            if symbol in self._books:
+                self._last_access[symbol] = time.time()
+                return None
+            if len(self._books) >= settings.DEPTH_MAX_SUBSCRIPTIONS:
+                raise DepthCapacityError("Se alcanzó el máximo de libros suscritos")
+
+        try:
+            snapshot = get_futures_client().depth(symbol=symbol, limit=1000)
+        except Exception as e:
+            if _is_client_error(e):
+                raise ValueError(f"Símbolo no válido para depth: {symbol}") from e
+            raise
+
+        with self._lock:
+            if symbol in self._books:
+                return snapshot
+            if len(self._books) >= settings.DEPTH_MAX_SUBSCRIPTIONS:
+                raise DepthCapacityError("Se alcanzó el máximo de libros suscritos")
+            self._books[symbol] = OrderBook(symbol)
+            self._pending[symbol] = []
+            self._last_access[symbol] = time.time()
+
+        self._get_ws().diff_book_depth(symbol=symbol.lower(), speed=settings.DEPTH_STREAM_SPEED)
+        # El snapshot de validación es anterior al stream: se pide otro
+        self._resync(symbol)
+        return snapshot
+
+    def unsubscribe(self, symbol: str) -> None:
+        with self._lock:
+            if self._books.pop(symbol, None) is None:
+                return
+            self._pending.pop(symbol, None)
+            self._last_access.pop(symbol, None)
+
+        if self._ws is not None:
+            try:
+                from binance.websocket.um_futures.websocket_client import UMFuturesWebsocketClient
+                self._ws.diff_book_depth(symbol=symbol.lower(), speed=settings.DEPTH_STREAM_SPEED,
+                                         action=UMFuturesWebsocketClient.ACTION_UNSUBSCRIBE)
+            except Exception as e:
+                logger.error(f"Error unsubscribing depth for {symbol}: {e}")
+        logger.info(f"Depth book for {symbol} unsubscribed")
+
+    def evict_idle(self) -> None:
+        """Cancela los libros sin consultas en DEPTH_IDLE_SECONDS (salvo DEPTH_SYMBOLS)"""
+        pinned = {s.upper() for s in split_setting(settings.DEPTH_SYMBOLS)}
+        cutoff = time.time() - settings.DEPTH_IDLE_SECONDS
+        with self._lock:
+            idle = [s for s, t in self._last_access.items() if t < cutoff and s not in pinned]
+        for symbol in idle:
+            self.unsubscribe(symbol)
+
+    def _evict_idle_loop(self) -> None:
+        while True:
+            time.sleep(settings.DEPTH_IDLE_SECONDS)
+            self.evict_idle()
+
+    def _resync(self, symbol: str, attempt: int = 0) -> None:
+        threading.Thread(target=self._load_snapshot, args=(symbol, attempt), daemon=True).start()
+
+    def _retry(self, symbol: str, attempt: int) -> None:
+        if attempt >= settings.DEPTH_MAX_RESYNC_ATTEMPTS:
+            logger.error(f"Depth book for {symbol} could not sync after {attempt + 1} attempts, dropping it")
+            self.unsubscribe(symbol)
+            return
+        time.sleep(settings.DEPTH_RESYNC_DELAY)
+        self._resync(symbol, attempt + 1)
+
+    def _load_snapshot(self, symbol: str, attempt: int = 0) -> None:
+        try:
+            snapshot = get_futures_client().depth(symbol=symbol, limit=1000)
+        except Exception as e:
+            logger.error(f"Error getting depth snapshot for {symbol}: {e}")
+            if _is_client_error(e):
+                self.unsubscribe(symbol)
+            else:
+                self._retry(symbol, attempt)
+            return
+
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                return
+            book.load_snapshot(snapshot)
+            pending, self._pending[symbol] = self._pending[symbol] or [], None
+            for event in pending:
+                if not book.apply_event(event):
+                    self._pending[symbol] = []
+                    break
+            synced = self._pending[symbol] is None
+
+        if not synced:
+            logger.warning(f"Depth snapshot for {symbol} is older than the stream, resyncing")
+            self._retry(symbol, attempt)
+
+    def _on_message(self, _, message: str) -> None:
+        event = json.loads(message)
+        event = event.get("data", event)
+        if event.get("e") != "depthUpdate":
+            return
+
+        symbol = event["s"]
+        resync = False
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                return
+            pending = self._pending.get(symbol)
+            if pending is not None:
+                if len(pending) < settings.DEPTH_MAX_PENDING_EVENTS:
+                    pending.append(event)
+                return
+            if not book.apply_event(event):
+                logger.warning(f"Gap in depth stream for {symbol}, resyncing")
+                self._pending[symbol] = [event]
+                resync = True
+
+        if resync:
+            self._resync(symbol)
+
+    def get_depth(self, symbol: str, step: Optional[float] = None, range_pct: float = 2.0,
+                  wall_factor: float = 5.0, subscribe: bool = True) -> Optional[Dict]:
+        """
+        Agregado del libro local. Mientras el libro se sincroniza se responde
+        con un snapshot REST puntual. Con subscribe=False solo se usan libros
+        ya sincronizados y se devuelve None si no hay. Un símbolo inexistente
+        lanza ValueError.
+        """
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is not None and subscribe:
+                self._last_access[symbol] = time.time()
+            if book is not None and book.synced and self._pending.get(symbol) is None:
+                return aggregate_depth(book, step, range_pct, wall_factor)
+
+        if not subscribe:
+            return None
+
+        # Sin hueco (o en replay) se sirve el snapshot sin suscribir; un
+        # símbolo inválido lanza ValueError desde subscribe
+        self.evict_idle()
+        snapshot = None
+        if not is_replay():
+            try:
+                snapshot = self.subscribe(symbol)
+            except DepthCapacityError as e:
+                logger.warning(f"Not subscribing depth for {symbol}: {e}")
+
+        if snapshot is None:
+            try:
+                snapshot = get_futures_client().depth(symbol=symbol, limit=1000)
+            except Exception as e:
+                if _is_client_error(e):
+                    raise ValueError(f"Símbolo no válido para depth: {symbol}") from e
+                raise
+        book = OrderBook(symbol)
+        book.load_snapshot(snapshot)
+        return aggregate_depth(book, step, range_pct, wall_factor)
+
+    def start(self) -> None:
+        """Suscribe los símbolos configurados en DEPTH_SYMBOLS"""
+        for symbol in split_setting(settings.DEPTH_SYMBOLS):
+            try:
+                self.subscribe(symbol.upper())
+            except Exception as e:
+                logger.error(f"Error subscribing depth for {symbol}: {e}")
+
+
+manager = DepthManager()
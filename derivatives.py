@@ -0,0 +1,203 @@
+"""
+Datos de derivados de futuros: mark price, funding, open interest y ratio
+long/short.
+
+Un único hilo reparte las peticiones según su peso en la API de Binance:
+el premiumIndex llega en bloque para todos los contratos, mientras que open
+interest y long/short (una petición por símbolo) se recorren en rondas con
+un presupuesto de peticiones por minuto. Cada serie se guarda en un buffer
+circular de arrays NumPy y las rutas leen siempre de memoria.
+"""
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import get_settings
+from market_data import get_all_futures_symbols, get_futures_client
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PREMIUM_FIELDS = ("mark_price", "index_price", "funding_rate")
+OPEN_INTEREST_FIELDS = ("open_interest",)
+LONG_SHORT_FIELDS = ("long_short_ratio", "long_account", "short_account")
+
+
+class RingSeries:
+    """Serie temporal de capacidad fija: times (int64) y values (float64, una columna por campo)"""
+
+    __slots__ = ("fields", "times", "values", "size", "head")
+
+    def __init__(self, fields: Tuple[str, ...], capacity: int):
+        self.fields = fields
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, len(fields)), np.nan)
+        self.size = 0
+        self.head = 0  # siguiente posición a escribir
+
+    def append(self, timestamp: int, values: Tuple[float, ...]) -> None:
+        # Ignorar muestras repetidas (mismo timestamp que la última)
+        if self.size and self.times[(self.head - 1) % len(self.times)] == timestamp:
+            return
+        self.times[self.head] = timestamp
+        self.values[self.head] = values
+        self.head = (self.head + 1) % len(self.times)
+        self.size = min(self.size + 1, len(self.times))
+
+    def latest(self) -> Optional[Dict]:
+        if not self.size:
+            return None
+        i = (self.head - 1) % len(self.times)
+        return dict(zip(self.fields, map(float, self.values[i])), time=int(self.times[i]))
+
+    def to_dict(self) -> Dict[str, List]:
+        """Serie completa en orden cronológico"""
+        order = (np.arange(self.size) + self.head - self.size) % len(self.times)
+        series = {"time": self.times[order].tolist()}
+        for col, field in enumerate(self.fields):
+            series[field] = self.values[order, col].tolist()
+        return series
+
+
+class DerivativesStore:
+    """Caché de datos de derivados actualizado por un planificador con presupuesto de peso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._premium: Dict[str, RingSeries] = {}
+        self._next_funding: Dict[str, int] = {}
+        self._open_interest: Dict[str, RingSeries] = {}
+        self._long_short: Dict[str, RingSeries] = {}
+        # Posición de cada recorrido por símbolos
+        self._cursors = {"open_interest": 0, "long_short": 0}
+        self._started = False
+
+    def _series(self, store: Dict[str, RingSeries], symbol: str, fields: Tuple[str, ...]) -> RingSeries:
+        series = store.get(symbol)
+        if series is None:
+            series = RingSeries(fields, settings.DERIVATIVES_HISTORY)
+            store[symbol] = series
+        return series
+
+    # --- Actualización ---
+
+    def update_premium(self) -> None:
+        """premiumIndex de todos los contratos en una petición"""
+        trading = set(get_all_futures_symbols())
+        entries = get_futures_client().mark_price()
+        with self._lock:
+            for entry in entries:
+                symbol = entry["symbol"]
+                if trading and symbol not in trading:
+                    continue
+                self._series(self._premium, symbol, PREMIUM_FIELDS).append(
+                    entry["time"],
+                    (float(entry["markPrice"]), float(entry["indexPrice"]), float(entry["lastFundingRate"] or 0)),
+                )
+                self._next_funding[symbol] = entry["nextFundingTime"]
+
+    def _next_batch(self, name: str, size: int) -> List[str]:
+        symbols = get_all_futures_symbols()
+        if not symbols:
+            return []
+        start = self._cursors[name] % len(symbols)
+        batch = (symbols[start:] + symbols[:start])[:size]
+        self._cursors[name] = start + len(batch)
+        return batch
+
+    def update_open_interest(self, size: int) -> None:
+        client = get_futures_client()
+        for symbol in self._next_batch("open_interest", size):
+            try:
+                entry = client.open_interest(symbol=symbol)
+            except Exception as e:
+                logger.error(f"Error getting open interest for {symbol}: {e}")
+                continue
+            if not entry:
+                continue
+            with self._lock:
+                self._series(self._open_interest, symbol, OPEN_INTEREST_FIELDS).append(
+                    entry["time"], (float(entry["openInterest"]),)
+                )
+
+    def update_long_short(self, size: int) -> None:
+        client = get_futures_client()
+        for symbol in self._next_batch("long_short", size):
+            try:
+                entries = client.long_short_account_ratio(
+                    symbol=symbol, period=settings.DERIVATIVES_RATIO_PERIOD, limit=1
+                )
+            except Exception as e:
+                logger.error(f"Error getting long/short ratio for {symbol}: {e}")
+                continue
+            if not entries:
+                continue
+            entry = entries[-1]
+            with self._lock:
+                self._series(self._long_short, symbol, LONG_SHORT_FIELDS).append(
+                    entry["timestamp"],
+                    (float(entry["longShortRatio"]), float(entry["longAccount"]), float(entry["shortAccount"])),
+                )
+
+    def _run(self) -> None:
+        tick = settings.DERIVATIVES_TICK_SECONDS
+        # Peticiones por tick según el presupuesto por minuto
+        oi_batch = max(1, settings.DERIVATIVES_OPEN_INTEREST_PER_MINUTE * tick // 60)
+        ratio_batch = max(1, settings.DERIVATIVES_RATIO_PER_MINUTE * tick // 60)
+        next_premium = 0.0
+
+        while True:
+            started = time.time()
+            try:
+                if started >= next_premium:
+                    self.update_premium()
+                    next_premium = started + settings.DERIVATIVES_PREMIUM_SECONDS
+                self.update_open_interest(oi_batch)
+                self.update_long_short(ratio_batch)
+            except Exception as e:
+                logger.error(f"Error updating derivatives data: {e}")
+            time.sleep(max(0.0, tick - (time.time() - started)))
+
+    def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._run, name="derivatives", daemon=True).start()
+
+    # --- Lectura ---
+
+    def snapshot(self, symbol: str) -> Optional[Dict]:
+        """Últimos valores conocidos de un símbolo (None si no hay datos)"""
+        with self._lock:
+            premium = self._premium.get(symbol)
+            open_interest = self._open_interest.get(symbol)
+            long_short = self._long_short.get(symbol)
+            if premium is None and open_interest is None and long_short is None:
+                return None
+            return {
+                "symbol": symbol,
+                "premium": premium.latest() if premium else None,
+                "next_funding_time": self._next_funding.get(symbol),
+                "open_interest": open_interest.latest() if open_interest else None,
+                "long_short": long_short.latest() if long_short else None,
+            }
+
+    def snapshot_all(self) -> List[Dict]:
+        with self._lock:
+            symbols = set(self._premium) | set(self._open_interest) | set(self._long_short)
+        return [s for s in (self.snapshot(symbol) for symbol in sorted(symbols)) if s]
+
+    def history(self, symbol: str) -> Dict:
+        with self._lock:
+            return {
+                name: store[symbol].to_dict() if symbol in store else None
+                for name, store in (("premium", self._premium),
+                                    ("open_interest", self._open_interest),
+                                    ("long_short", self._long_short))
+            }
+
+
+store = DerivativesStore()
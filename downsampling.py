@@ -0,0 +1,224 @@
+"""
+Reducción de resolución de velas para gráficos de rango largo.
+
+- Modo "ohlc": agrupa velas consecutivas en buckets conservando apertura,
+  máximo, mínimo y cierre, y sumando volúmenes y trades.
+- Modo "line": Largest-Triangle-Three-Buckets sobre el cierre; devuelve un
+  subconjunto de las velas originales que preserva la forma de la serie.
+
+Los resultados se cachean por (símbolo, intervalo, rango, resolución). Para
+rangos abiertos (`start` sin `end`) se guarda además un historial por
+(símbolo, intervalo) del que se recorta cada petición; solo se descargan las
+velas que aún no tiene.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import get_settings
+from market_data import INTERVAL_MS, fetch_klines, fetch_klines_range, now_ms
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+MODES = ("ohlc", "line")
+
+# Columnas de una vela de Binance que se usan (las 11 primeras)
+TIME, OPEN, HIGH, LOW, CLOSE, VOLUME, CLOSE_TIME, QUOTE_VOLUME, TRADES, TAKER_BASE, TAKER_QUOTE = range(11)
+
+_cache: "OrderedDict[Tuple, List]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# (símbolo, intervalo) -> {"data": velas como array (N, 11), "from": start más antiguo cubierto}
+_history: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+
+
+def _to_array(klines: List) -> np.ndarray:
+    return np.array([k[:11] for k in klines], dtype=np.float64).reshape(-1, 11)
+
+
+def _to_rows(data: np.ndarray) -> List[List]:
+    """Filas con el formato de vela de Binance (tiempos y trades enteros)"""
+    rows = data.tolist()
+    for row in rows:
+        row[TIME] = int(row[TIME])
+        row[CLOSE_TIME] = int(row[CLOSE_TIME])
+        row[TRADES] = int(row[TRADES])
+    return rows
+
+
+def ohlc_buckets(data: np.ndarray, max_points: int) -> np.ndarray:
+    """Agrupa velas consecutivas en como máximo `max_points` velas"""
+    n = len(data)
+    if n <= max_points:
+        return data
+    size = -(-n // max_points)  # ceil
+    starts = np.arange(0, n, size)
+    ends = np.minimum(starts + size, n) - 1
+
+    out = np.empty((len(starts), 11))
+    out[:, TIME] = data[starts, TIME]
+    out[:, OPEN] = data[starts, OPEN]
+    out[:, HIGH] = np.maximum.reduceat(data[:, HIGH], starts)
+    out[:, LOW] = np.minimum.reduceat(data[:, LOW], starts)
+    out[:, CLOSE] = data[ends, CLOSE]
+    out[:, CLOSE_TIME] = data[ends, CLOSE_TIME]
+    for col in (VOLUME, QUOTE_VOLUME, TRADES, TAKER_BASE, TAKER_QUOTE):
+        out[:, col] = np.add.reduceat(data[:, col], starts)
+    return out
+
+
+def lttb(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Índices elegidos por Largest-Triangle-Three-Buckets. El primer y el
+    último punto siempre se conservan.
+    """
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return np.arange(n) if n <= max_points else np.array([0, n - 1])
+
+    # max_points - 2 buckets interiores: [edges[i], edges[i + 1])
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    bounds = np.append(edges, n)
+
+    # Media de cada bucket (y del último punto, que hace de bucket final)
+    counts = np.diff(bounds)
+    avg_x = np.add.reduceat(x, edges) / counts
+    avg_y = np.add.reduceat(y, edges) / counts
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    # Cada elección depende de la anterior: se recorre bucket a bucket,
+    # vectorizando el cálculo de áreas dentro de cada uno
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Área del triángulo (punto elegido, candidato, media del bucket siguiente)
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(klines: List, max_points: int, mode: str = "ohlc") -> List[List]:
+    return _downsample_array(_to_array(klines), max_points, mode)
+
+
+def _downsample_array(data: np.ndarray, max_points: int, mode: str) -> List[List]:
+    if mode == "line":
+        return _to_rows(data[lttb(data[:, TIME], data[:, CLOSE], max_points)])
+    return _to_rows(ohlc_buckets(data, max_points))
+
+
+def _cached(key: Tuple) -> Optional[List]:
+    with _cache_lock:
+        rows = _cache.get(key)
+        if rows is not None:
+            _cache.move_to_end(key)
+        return rows
+
+
+def _store(key: Tuple, rows: List) -> None:
+    with _cache_lock:
+        _cache[key] = rows
+        while len(_cache) > settings.DOWNSAMPLE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _snap(interval: str, start: Optional[int], end: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Ajusta `start` y `end` a la rejilla del intervalo sin cambiar qué velas
+    entran en el rango, para que peticiones casi iguales compartan caché.
+    Las velas semanales y mensuales no siguen una rejilla fija y no se ajustan.
+    """
+    interval_ms = INTERVAL_MS.get(interval)
+    if not interval_ms or interval in ("1w", "1M"):
+        return start, end
+    if start is not None:
+        start = -(-start // interval_ms) * interval_ms
+    if end is not None:
+        end -= end % interval_ms
+    return start, end
+
+
+def _open_range(symbol: str, interval: str, start: int) -> np.ndarray:
+    """
+    Velas desde `start` hasta ahora, servidas desde un único historial por
+    (símbolo, intervalo). Solo se descargan las velas desde la última guardada
+    (que puede seguir abierta) y, si `start` es anterior a lo ya cubierto, las
+    que faltan por delante. El historial guarda las KLINES_RANGE_MAX_CANDLES
+    velas más recientes.
+    """
+    key = (symbol, interval)
+    with _cache_lock:
+        entry = _history.get(key)
+        if entry is not None:
+            _history.move_to_end(key)
+
+    if entry is None or not len(entry["data"]):
+        data, covered = _to_array(fetch_klines_range(symbol, interval, start)), start
+    else:
+        data, covered = entry["data"], entry["from"]
+        tail = fetch_klines_range(symbol, interval, int(data[-1, TIME]))
+        if tail:
+            data = np.concatenate([data[:-1], _to_array(tail)])
+        if start < covered:
+            head = fetch_klines_range(symbol, interval, start, int(data[0, TIME]) - 1)
+            if head:
+                data = np.concatenate([_to_array(head), data])
+            covered = start
+        data = data[-settings.KLINES_RANGE_MAX_CANDLES:]
+
+    with _cache_lock:
+        _history[key] = {"data": data, "from": covered}
+        _history.move_to_end(key)
+        while len(_history) > settings.DOWNSAMPLE_HISTORY_CACHE_SIZE:
+            _history.popitem(last=False)
+    return data[np.searchsorted(data[:, TIME], start):]
+
+
+def get_downsampled_klines(symbol: str, interval: str, max_points: int, mode: str = "ohlc",
+                           start: Optional[int] = None, end: Optional[int] = None) -> List[List]:
+    """
+    Velas de `symbol` entre `start` y `end` (ms) reducidas a `max_points`.
+    Sin `start` se usa el historial en caché de market_data y sin `end` el
+    historial por (símbolo, intervalo) de `_open_range`. Los rangos que
+    terminan antes de la vela actual no cambian y se cachean sin descargar;
+    el resto se cachea junto al estado de la última vela.
+    """
+    interval_ms = INTERVAL_MS.get(interval, 0)
+    start, end = _snap(interval, start, end)
+    if start is not None and end is None and interval_ms:
+        # Lo anterior no cabe en el historial: no pedirlo para descartarlo
+        start = max(start, now_ms() - settings.KLINES_RANGE_MAX_CANDLES * interval_ms)
+    historical = start is not None and end is not None and end < now_ms() - interval_ms
+    key = (symbol, interval, start, end, max_points, mode)
+    if historical:
+        rows = _cached(key)
+        if rows is not None:
+            return rows
+
+    if start is not None and end is None:
+        data = _open_range(symbol, interval, start)
+    elif start is not None:
+        data = _to_array(fetch_klines_range(symbol, interval, start, end))
+    else:
+        data = _to_array(fetch_klines(symbol, interval))
+    if not len(data):
+        return []
+
+    if not historical:
+        last = data[-1]
+        key = key + (len(data), last[TIME], last[CLOSE], last[VOLUME])
+        rows = _cached(key)
+        if rows is not None:
+            return rows
+
+    rows = _downsample_array(data, max_points, mode)
+    _store(key, rows)
+    return rows
@@ -0,0 +1,313 @@
+"""
+Pipeline configurable de indicadores.
+
+Las peticiones se declaran como texto (`ema:9,ema:21,rsi:7,adx:14`) y se
+resuelven sobre un grafo de nodos memoizados: los intermedios compartidos
+(EMAs que alimentan el MACD, desviación estándar, true range, suavizados de
+Wilder...) se calculan una sola vez y solo se evalúa lo que se pide. El grafo
+de cada (símbolo, intervalo, última vela) se conserva para que peticiones
+posteriores sobre la misma vela reutilicen sus nodos.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+OPEN = ("open",)
+HIGH = ("high",)
+LOW = ("low",)
+CLOSE = ("close",)
+VOLUME = ("volume",)
+
+
+class IndicatorGraph:
+    """Grafo de cálculo sobre un DataFrame de velas; cada nodo se calcula una vez"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._memo: Dict[Tuple, pd.Series] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> pd.Series:
+        series = self._memo.get(key)
+        if series is None:
+            series = _NODES[key[0]](self, *key[1:])
+            self._memo[key] = series
+        return series
+
+    def evaluate(self, requests: List[Tuple[str, Tuple[int, ...]]]) -> Dict[str, Dict[str, pd.Series]]:
+        with self._lock:
+            return {
+                _label(name, params): INDICATORS[name][1](self, *params)
+                for name, params in requests
+            }
+
+
+# --- Nodos intermedios ---
+
+def _column(g: IndicatorGraph, name: str) -> pd.Series:
+    return g.df[name]
+
+
+def _sma(g: IndicatorGraph, src: Tuple, n: int) -> pd.Series:
+    return g.get(src).rolling(window=n).mean()
+
+
+def _ema(g: IndicatorGraph, src: Tuple, n: int) -> pd.Series:
+    return g.get(src).ewm(span=n, adjust=False).mean()
+
+
+def _std(g: IndicatorGraph, src: Tuple, n: int) -> pd.Series:
+    return g.get(src).rolling(window=n).std()
+
+
+def _rma(g: IndicatorGraph, src: Tuple, n: int) -> pd.Series:
+    """Suavizado de Wilder sembrado con la media simple, como TA-Lib"""
+    s = g.get(src)
+    values = s.to_numpy(dtype=float)
+    out = np.full(len(values), np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) >= n:
+        start = valid[0]
+        seeded = s.iloc[start + n - 1:].copy()
+        seeded.iloc[0] = values[start:start + n].mean()
+        out[start + n - 1:] = seeded.ewm(alpha=1 / n, adjust=False).mean().to_numpy()
+    return pd.Series(out, index=s.index)
+
+
+def _rolling_max(g: IndicatorGraph, src: Tuple, n: int) -> pd.Series:
+    return g.get(src).rolling(window=n).max()
+
+
+def _rolling_min(g: IndicatorGraph, src: Tuple, n: int) -> pd.Series:
+    return g.get(src).rolling(window=n).min()
+
+
+def _diff(g: IndicatorGraph, src: Tuple) -> pd.Series:
+    return g.get(src).diff()
+
+
+def _gain(g: IndicatorGraph, src: Tuple) -> pd.Series:
+    return g.get(("diff", src)).clip(lower=0)
+
+
+def _loss(g: IndicatorGraph, src: Tuple) -> pd.Series:
+    return -g.get(("diff", src)).clip(upper=0)
+
+
+def _true_range(g: IndicatorGraph) -> pd.Series:
+    prev_close = g.get(CLOSE).shift(1)
+    high, low = g.get(HIGH), g.get(LOW)
+    tr = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+    tr.iloc[0] = np.nan  # sin cierre previo, como TA-Lib
+    return tr
+
+
+def _dm_plus(g: IndicatorGraph) -> pd.Series:
+    up, down = g.get(("diff", HIGH)), -g.get(("diff", LOW))
+    return up.where((up > down) & (up > 0), 0.0).where(up.notna())
+
+
+def _dm_minus(g: IndicatorGraph) -> pd.Series:
+    up, down = g.get(("diff", HIGH)), -g.get(("diff", LOW))
+    return down.where((down > up) & (down > 0), 0.0).where(down.notna())
+
+
+def _di(g: IndicatorGraph, dm: str, n: int) -> pd.Series:
+    return 100 * g.get(("rma", (dm,), n)) / g.get(("rma", ("true_range",), n))
+
+
+def _dx(g: IndicatorGraph, n: int) -> pd.Series:
+    plus, minus = g.get(("di", "dm_plus", n)), g.get(("di", "dm_minus", n))
+    return 100 * (plus - minus).abs() / (plus + minus)
+
+
+def _stoch_k(g: IndicatorGraph, n: int) -> pd.Series:
+    highest, lowest = g.get(("rolling_max", HIGH, n)), g.get(("rolling_min", LOW, n))
+    return 100 * (g.get(CLOSE) - lowest) / (highest - lowest)
+
+
+def _macd_line(g: IndicatorGraph, fast: int, slow: int) -> pd.Series:
+    return g.get(("ema", CLOSE, fast)) - g.get(("ema", CLOSE, slow))
+
+
+_NODES: Dict[str, Callable[..., pd.Series]] = {
+    "open": lambda g: _column(g, "open"),
+    "high": lambda g: _column(g, "high"),
+    "low": lambda g: _column(g, "low"),
+    "close": lambda g: _column(g, "close"),
+    "volume": lambda g: _column(g, "volume"),
+    "sma": _sma,
+    "ema": _ema,
+    "std": _std,
+    "rma": _rma,
+    "rolling_max": _rolling_max,
+    "rolling_min": _rolling_min,
+    "diff": _diff,
+    "gain": _gain,
+    "loss": _loss,
+    "true_range": _true_range,
+    "dm_plus": _dm_plus,
+    "dm_minus": _dm_minus,
+    "di": _di,
+    "dx": _dx,
+    "stoch_k": _stoch_k,
+    "macd_line": _macd_line,
+}
+
+
+# --- Indicadores públicos ---
+
+def _rsi(g: IndicatorGraph, n: int) -> Dict[str, pd.Series]:
+    avg_gain, avg_loss = g.get(("rma", ("gain", CLOSE), n)), g.get(("rma", ("loss", CLOSE), n))
+    return {"value": 100 - 100 / (1 + avg_gain / avg_loss)}
+
+
+def _bollinger(g: IndicatorGraph, n: int, k: int) -> Dict[str, pd.Series]:
+    middle, std = g.get(("sma", CLOSE, n)), g.get(("std", CLOSE, n))
+    return {"upper": middle + std * k, "middle": middle, "lower": middle - std * k}
+
+
+def _macd(g: IndicatorGraph, fast: int, slow: int, signal: int) -> Dict[str, pd.Series]:
+    line = g.get(("macd_line", fast, slow))
+    signal_line = g.get(("ema", ("macd_line", fast, slow), signal))
+    return {"macd": line, "signal": signal_line, "histogram": line - signal_line}
+
+
+def _adx(g: IndicatorGraph, n: int) -> Dict[str, pd.Series]:
+    return {
+        "adx": g.get(("rma", ("dx", n), n)),
+        "plus_di": g.get(("di", "dm_plus", n)),
+        "minus_di": g.get(("di", "dm_minus", n)),
+    }
+
+
+def _stochastic(g: IndicatorGraph, n: int, d: int) -> Dict[str, pd.Series]:
+    return {"k": g.get(("stoch_k", n)), "d": g.get(("sma", ("stoch_k", n), d))}
+
+
+def _obv(g: IndicatorGraph) -> Dict[str, pd.Series]:
+    direction = np.sign(g.get(("diff", CLOSE))).fillna(0)
+    return {"value": (direction * g.get(VOLUME)).cumsum()}
+
+
+def _vwap(g: IndicatorGraph) -> Dict[str, pd.Series]:
+    """VWAP de sesión: se reinicia cada día UTC"""
+    typical = (g.get(HIGH) + g.get(LOW) + g.get(CLOSE)) / 3
+    volume = g.get(VOLUME)
+    day = g.df.index.floor("D")
+    cum_pv = (typical * volume).groupby(day).cumsum()
+    cum_volume = volume.groupby(day).cumsum()
+    return {"value": cum_pv / cum_volume}
+
+
+# nombre -> (parámetros por defecto, función)
+INDICATORS: Dict[str, Tuple[Tuple[int, ...], Callable[..., Dict[str, pd.Series]]]] = {
+    "sma": ((20,), lambda g, n: {"value": g.get(("sma", CLOSE, n))}),
+    "ema": ((21,), lambda g, n: {"value": g.get(("ema", CLOSE, n))}),
+    "rsi": ((14,), _rsi),
+    "bb": ((20, 2), _bollinger),
+    "macd": ((12, 26, 9), _macd),
+    "atr": ((14,), lambda g, n: {"value": g.get(("rma", ("true_range",), n))}),
+    "adx": ((14,), _adx),
+    "stoch": ((14, 3), _stochastic),
+    "obv": ((), _obv),
+    "vwap": ((), _vwap),
+}
+
+
+def _label(name: str, params: Tuple[int, ...]) -> str:
+    return ":".join([name, *map(str, params)])
+
+
+def parse_indicators(spec: str) -> List[Tuple[str, Tuple[int, ...]]]:
+    """
+    Convierte `ema:9,rsi:7,macd` en [("ema", (9,)), ("rsi", (7,)), ("macd", (12, 26, 9))].
+    Los parámetros omitidos toman su valor por defecto.
+    """
+    requests = []
+    for item in spec.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        name, *raw_params = item.split(":")
+        if name not in INDICATORS:
+            raise HTTPException(status_code=400, detail=f"Indicador desconocido: {name}")
+        defaults = INDICATORS[name][0]
+        if len(raw_params) > len(defaults):
+            raise HTTPException(status_code=400, detail=f"Demasiados parámetros para {name}")
+        try:
+            params = tuple(int(p) for p in raw_params)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Parámetros no válidos en {item}")
+        if any(p < 1 or p > settings.KLINES_CACHE_LIMIT for p in params):
+            raise HTTPException(status_code=400, detail=f"Parámetros fuera de rango en {item}")
+        params = params + defaults[len(params):]
+        if (name, params) not in requests:
+            requests.append((name, params))
+
+    if not requests:
+        raise HTTPException(status_code=400, detail="No se pidió ningún indicador")
+    if len(requests) > settings.INDICATORS_MAX_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"Máximo {settings.INDICATORS_MAX_PER_REQUEST} indicadores por petición")
+    return requests
+
+
+_graphs: "OrderedDict[Tuple, IndicatorGraph]" = OrderedDict()
+_graphs_lock = threading.Lock()
+
+
+def _get_graph(symbol: str, interval: str, klines: List) -> IndicatorGraph:
+    """Grafo memoizado por (símbolo, intervalo, última vela)"""
+    from analysis import klines_to_dataframe
+
+    last = klines[-1]
+    # La vela en curso cambia sin cambiar su open time: se incluye su estado
+    key = (symbol, interval, len(klines), last[0], last[4], last[5])
+    with _graphs_lock:
+        graph = _graphs.get(key)
+        if graph is not None:
+            _graphs.move_to_end(key)
+            return graph
+
+    graph = IndicatorGraph(klines_to_dataframe(klines))
+    with _graphs_lock:
+        _graphs[key] = graph
+        while len(_graphs) > settings.INDICATORS_CACHE_SIZE:
+            _graphs.popitem(last=False)
+    return graph
+
+
+def _to_json(series: pd.Series, points: int):
+    values = [None if np.isnan(v) else round(float(v), 8) for v in series.iloc[-points:]]
+    return values[-1] if points == 1 else values
+
+
+def compute_indicators(symbol: str, interval: str, klines: List, spec: str, points: int = 1) -> Dict:
+    """
+    Evalúa los indicadores de `spec` sobre `klines`. Con points > 1 cada valor
+    es la lista de los últimos `points` valores.
+    """
+    if not klines:
+        raise HTTPException(status_code=500, detail="No se obtuvieron datos de klines de Binance")
+
+    requests = parse_indicators(spec)
+    points = max(1, min(points, len(klines)))
+    results = _get_graph(symbol, interval, klines).evaluate(requests)
+
+    output = {}
+    for label, outputs in results.items():
+        if list(outputs) == ["value"]:
+            output[label] = _to_json(outputs["value"], points)
+        else:
+            output[label] = {name: _to_json(series, points) for name, series in outputs.items()}
+    return output
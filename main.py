@@ -1,19 +1,29 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from binance import Client as Spot
-from binance.um_futures import UMFutures
-import pandas as pd
-import numpy as np
 import os
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional
 import logging
-import talib
 import requests
 from fastapi.responses import JSONResponse
 from config import get_settings
 import portfolio_routes
-from analysis import calculate_indicators, generate_trading_suggestion
+import alert_routes
+from market_data import (
+    INTERVAL_MS,
+    fetch_coingecko_markets,
+    fetch_klines,
+    fetch_klines_range,
+    get_all_futures_symbols,
+    get_replay_client,
+    is_ready,
+    is_replay,
+    now_ms,
+    start_warmup,
+)
+
+# pandas, numpy, TA-Lib y los SDK de Binance se importan de forma perezosa
+# (en analysis.py y market_data.py) para que el arranque sea rápido.
 
 # Cargar variables de entorno
 load_dotenv()
@@ -48,26 +58,32 @@ settings = get_settings()
 
 # Incluir rutas 
 app.include_router(portfolio_routes.router, prefix="/api", tags=["portfolio"])
+app.include_router(alert_routes.router, prefix="/api", tags=["alerts"])
 
-# Configurar clientes de Binance
-futures_client = UMFutures()
-spot_client = Spot()
+@app.on_event("startup")
+def warmup_market_data():
+    # Precargar símbolos y velas de los símbolos más consultados
+    start_warmup()
 
-def is_futures_symbol(symbol: str) -> bool:
-    """Determina si un símbolo es de futuros basado en su formato"""
-    try:
-        # Los pares de futuros típicamente terminan en USDT o BUSD
-        return symbol.endswith(('USDT', 'BUSD'))
-    except Exception:
-        return False
+    # Evaluar alertas en cada cierre de vela
+    if settings.ALERTS_ENABLED:
+        from alerts import engine
+        engine.start()
 
-def get_all_futures_symbols():
-    try:
-        exchange_info = futures_client.exchange_info()
-        return [symbol['symbol'] for symbol in exchange_info['symbols'] if symbol['status'] == 'TRADING']
-    except Exception as e:
-        logger.error(f"Error getting futures symbols: {e}")
-        return []
+    # Resumen de mercado refrescado en segundo plano
+    if settings.MARKET_OVERVIEW_ENABLED:
+        import market_overview
+        market_overview.start()
+
+    # Funding, open interest y long/short de todos los contratos
+    if settings.DERIVATIVES_ENABLED:
+        from derivatives import store
+        store.start()
+
+    # Libros de órdenes configurados
+    if settings.DEPTH_SYMBOLS:
+        from depth import manager
+        manager.start()
 
 @app.get("/symbols")
 def get_symbols():
@@ -79,23 +95,30 @@ def get_symbols():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/analysis/{symbol}")
-def get_analysis(symbol: str, interval: str = "1h"):
+def get_analysis(symbol: str, interval: str = "1h", indicators: Optional[str] = None,
+                 derivatives: bool = False):
+    from analysis import calculate_indicators, generate_trading_suggestion
+
     try:
-        # Determinar qué cliente usar basado en el símbolo
-        client = futures_client if is_futures_symbol(symbol) else spot_client
-        
         # Obtener datos históricos
-        try:
-            klines = client.klines(symbol, interval, limit=100)
-        except Exception as e:
-            logger.error(f"Error getting klines for {symbol}: {e}")
-            # Si falla con un cliente, intentar con el otro
-            client = spot_client if client == futures_client else futures_client
-            klines = client.klines(symbol, interval, limit=100)
-        
+        klines = fetch_klines(symbol, interval, limit=100)
+
         # Calcular indicadores
         analysis = calculate_indicators(klines)
+
+        # Indicadores adicionales pedidos con ?indicators=ema:9,rsi:7,...
+        if indicators:
+            from indicators import compute_indicators
+
+            custom_klines = fetch_klines(symbol, interval, limit=settings.INDICATORS_KLINES_LIMIT)
+            analysis["indicators"]["custom"] = compute_indicators(symbol, interval, custom_klines, indicators)
         
+        # Datos de derivados desde memoria (sin llamadas a Binance)
+        if derivatives:
+            from derivatives import store
+
+            analysis["derivatives"] = store.snapshot(symbol)
+
         # Generar sugerencia
         suggestion = generate_trading_suggestion(analysis)
         
@@ -105,23 +128,71 @@ def get_analysis(symbol: str, interval: str = "1h"):
             "analysis": analysis,
             "suggestion": suggestion
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in get_analysis: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/indicators/{symbol}")
+def get_indicators(symbol: str, indicators: str, interval: str = "1h", points: int = 1):
+    from indicators import compute_indicators
+
+    try:
+        klines = fetch_klines(symbol, interval, limit=settings.INDICATORS_KLINES_LIMIT)
+        return {
+            "symbol": symbol,
+            "interval": interval,
+            "time": klines[-1][0] if klines else None,
+            "indicators": compute_indicators(symbol, interval, klines, indicators, points)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_indicators: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/klines/{symbol}/{interval}")
-async def get_klines(symbol: str, interval: str):
+def get_klines(symbol: str, interval: str, since: Optional[int] = None,
+               max_points: Optional[int] = None, mode: str = "ohlc",
+               start: Optional[int] = None, end: Optional[int] = None):
     try:
-        # Determinar qué cliente usar
-        client = futures_client if is_futures_symbol(symbol) else spot_client
-        
-        try:
-            klines = client.klines(symbol=symbol, interval=interval, limit=1000)
-        except Exception:
-            # Si falla, intentar con el otro cliente
-            client = spot_client if client == futures_client else futures_client
-            klines = client.klines(symbol=symbol, interval=interval, limit=1000)
-        
+        if end is not None and (start is None or end < start):
+            raise HTTPException(status_code=400, detail="end requiere start y no puede ser anterior a él")
+        if start is not None and max_points is None:
+            # Sin reducción, un rango se limita a una página de velas
+            interval_ms = INTERVAL_MS.get(interval)
+            if interval_ms and ((end if end is not None else now_ms()) - start) // interval_ms >= settings.KLINES_CACHE_LIMIT:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Rangos de más de {settings.KLINES_CACHE_LIMIT} velas requieren max_points"
+                )
+
+        if max_points is not None:
+            from downsampling import MODES, get_downsampled_klines
+
+            if not 3 <= max_points <= settings.DOWNSAMPLE_MAX_POINTS or mode not in MODES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"max_points debe estar entre 3 y {settings.DOWNSAMPLE_MAX_POINTS} y mode ser uno de {MODES}"
+                )
+            if since is not None:
+                raise HTTPException(status_code=400, detail="since no se puede combinar con max_points")
+            # Serie reducida en el servidor (buckets OHLC o LTTB)
+            klines = get_downsampled_klines(symbol, interval, max_points, mode, start, end)
+        elif start is not None:
+            klines = fetch_klines_range(symbol, interval, start, end)
+        else:
+            klines = fetch_klines(symbol, interval, limit=1000)
+
+        # Con `since` (open time de la última vela que tiene el cliente) solo se
+        # devuelven las velas desde esa, incluida: puede seguir abierta y haber cambiado
+        if since is not None:
+            first = len(klines)
+            while first > 0 and klines[first - 1][0] >= since:
+                first -= 1
+            klines = klines[first:]
+
         # Convertir a formato esperado por el frontend
         formatted_klines = []
         for k in klines:
@@ -140,6 +211,8 @@ async def get_klines(symbol: str, interval: str):
             })
         
         return formatted_klines
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting klines: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -147,21 +220,12 @@ async def get_klines(symbol: str, interval: str):
 @app.get("/api/top-cryptos")
 def get_top_cryptos():
     try:
-        # Obtener datos de CoinGecko
-        response = requests.get(
-            "https://api.coingecko.com/api/v3/coins/markets",
-            params={
-                "vs_currency": "usd",
-                "order": "market_cap_desc",
-                "per_page": 100,
-                "page": 1,
-                "sparkline": False
-            }
-        )
-        response.raise_for_status()
-        
-        # Procesar y devolver los datos
-        data = response.json()
+        if is_replay():
+            # En modo replay se sirve la grabación de CoinGecko
+            data = get_replay_client().coingecko_markets()
+        else:
+            # Obtener datos de CoinGecko
+            data = fetch_coingecko_markets()
         
         # Transformar los datos al formato esperado
         formatted_data = []
@@ -184,26 +248,76 @@ def get_top_cryptos():
         logger.error(f"Error in get_top_cryptos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Ruta de resumen de mercado (tickers 24h de todos los futuros)
+@app.get("/api/market-overview")
+def get_market_overview(limit: Optional[int] = None):
+    from market_overview import get_overview
+
+    try:
+        return get_overview(limit)
+    except Exception as e:
+        logger.error(f"Error in get_market_overview: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Rutas de derivados: funding, open interest y ratio long/short
+@app.get("/api/derivatives")
+def get_derivatives():
+    from derivatives import store
+
+    return store.snapshot_all()
+
+@app.get("/api/derivatives/{symbol}")
+def get_symbol_derivatives(symbol: str, history: bool = False):
+    from derivatives import store
+
+    snapshot = store.snapshot(symbol.upper())
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No hay datos de derivados para el símbolo")
+    if history:
+        snapshot["history"] = store.history(symbol.upper())
+    return snapshot
+
+# Ruta de correlación y fuerza relativa entre símbolos
+@app.get("/api/correlation")
+def get_correlation(interval: str = "1h", window: int = 100, symbols: Optional[str] = None):
+    from correlation import compute_correlation
+    from market_data import split_setting
+
+    try:
+        symbol_list = split_setting(symbols.upper()) if symbols else None
+        return compute_correlation(interval, window, symbol_list)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_correlation: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Ruta de profundidad del libro de órdenes y muros de liquidez
+@app.get("/api/depth/{symbol}")
+def get_depth(symbol: str, step: Optional[float] = None, range_pct: float = 2.0, wall_factor: float = 5.0):
+    from depth import DepthCapacityError, manager
+
+    try:
+        return manager.get_depth(symbol.upper(), step, range_pct, wall_factor)
+    except DepthCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error getting depth: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Ruta para obtener patrones de velas
 @app.get("/api/patterns/{symbol}")
 async def get_patterns(symbol: str, interval: str = "1h"):
+    from analysis import detect_candlestick_patterns, klines_to_dataframe
+
     try:
-        klines = await get_klines(symbol, interval)
+        klines = fetch_klines(symbol, interval)
         if not klines:
             raise HTTPException(status_code=404, detail="No se encontraron datos para el símbolo")
 
-        df = pd.DataFrame(klines, columns=[
-            'timestamp', 'open', 'high', 'low', 'close', 'volume',
-            'close_time', 'quote_volume', 'trades', 'taker_buy_base',
-            'taker_buy_quote', 'ignore'
-        ])
-
-        # Convertir columnas numéricas
-        for col in ['open', 'high', 'low', 'close', 'volume']:
-            df[col] = pd.to_numeric(df[col])
-
-        # Establecer timestamp como índice
-        df.set_index(pd.to_datetime(df['timestamp'], unit='ms'), inplace=True)
+        df = klines_to_dataframe(klines)
 
         patterns = detect_candlestick_patterns(df)
         return {"patterns": patterns}
@@ -214,33 +328,27 @@ async def get_patterns(symbol: str, interval: str = "1h"):
 
 # Ruta para obtener niveles clave
 @app.get("/api/levels/{symbol}")
-async def get_levels(symbol: str, interval: str = "1h"):
+async def get_levels(symbol: str, interval: str = "1h", include_walls: bool = False):
+    from analysis import find_key_levels, get_levels_period, klines_to_dataframe
+
     try:
-        klines = await get_klines(symbol, interval)
+        klines = fetch_klines(symbol, interval)
         if not klines:
             raise HTTPException(status_code=404, detail="No se encontraron datos para el símbolo")
 
-        df = pd.DataFrame(klines, columns=[
-            'timestamp', 'open', 'high', 'low', 'close', 'volume',
-            'close_time', 'quote_volume', 'trades', 'taker_buy_base',
-            'taker_buy_quote', 'ignore'
-        ])
+        df = klines_to_dataframe(klines)
 
-        # Convertir columnas numéricas
-        for col in ['open', 'high', 'low', 'close', 'volume']:
-            df[col] = pd.to_numeric(df[col])
+        # Ajustar el período según el intervalo
+        levels = find_key_levels(df, get_levels_period(interval))
 
-        # Establecer timestamp como índice
-        df.set_index(pd.to_datetime(df['timestamp'], unit='ms'), inplace=True)
+        # Añadir muros del libro de órdenes si el símbolo ya está suscrito
+        if include_walls:
+            from depth import manager, walls_as_levels
 
-        # Ajustar el período según el intervalo
-        period = 20
-        if interval in ['1m', '5m']:
-            period = 10
-        elif interval in ['15m', '30m']:
-            period = 15
+            depth = manager.get_depth(symbol.upper(), subscribe=False)
+            if depth:
+                levels.extend(walls_as_levels(depth))
 
-        levels = find_key_levels(df, period)
         return {"levels": levels}
 
     except Exception as e:
@@ -252,6 +360,13 @@ async def get_levels(symbol: str, interval: str = "1h"):
 def read_root():
     return {"status": "ok", "message": "API is running"}
 
+# Ruta de disponibilidad: 503 hasta que termine el precalentamiento
+@app.get("/ready")
+def read_ready():
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", 8000)), reload=True)
@@ -0,0 +1,282 @@
+"""
+Acceso a datos de mercado de Binance.
+
+Los SDK de Binance se importan y se instancian de forma perezosa para que el
+arranque del servidor (y el health check) no pague su coste. Los símbolos y
+las velas se guardan en memoria para que varias rutas compartan la misma
+descarga.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_clients: Dict[str, object] = {}
+_clients_lock = threading.Lock()
+
+_symbols_cache: Dict[str, object] = {"symbols": [], "fetched_at": 0.0}
+_symbols_lock = threading.Lock()
+
+# (símbolo, intervalo) -> {"klines": [...], "fetched_at": float}
+# LRU acotado a KLINES_CACHE_MAX_ENTRIES: cada entrada ocupa ~0.8 MB
+_klines_cache: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+_klines_lock = threading.Lock()
+
+_ready = threading.Event()
+
+# Duración de cada intervalo de Binance en milisegundos ('1M' se aproxima a 30 días)
+INTERVAL_MS = {
+    '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '6h': 21_600_000,
+    '8h': 28_800_000, '12h': 43_200_000, '1d': 86_400_000, '3d': 259_200_000,
+    '1w': 604_800_000, '1M': 2_592_000_000,
+}
+
+COINGECKO_MARKETS_URL = "https://api.coingecko.com/api/v3/coins/markets"
+
+
+def split_setting(value: str) -> List[str]:
+    """Convierte un valor de configuración separado por comas en una lista"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def is_replay() -> bool:
+    return settings.DATA_SOURCE == "replay"
+
+
+def get_replay_client():
+    """Cliente sobre los datos grabados de REPLAY_DIR (modo replay)"""
+    client = _clients.get("replay")
+    if client is None:
+        with _clients_lock:
+            client = _clients.get("replay")
+            if client is None:
+                from replay import ReplayClient
+                client = ReplayClient(settings.REPLAY_DIR, settings.REPLAY_SPEED, settings.REPLAY_START)
+                _clients["replay"] = client
+    return client
+
+
+def get_futures_client():
+    """Devuelve el cliente de futuros USDⓈ-M, creándolo en el primer uso"""
+    if is_replay():
+        return get_replay_client()
+    client = _clients.get("futures")
+    if client is None:
+        with _clients_lock:
+            client = _clients.get("futures")
+            if client is None:
+                from binance.um_futures import UMFutures
+                client = UMFutures()
+                _clients["futures"] = client
+    return client
+
+
+def get_spot_client():
+    """Devuelve el cliente spot, creándolo en el primer uso"""
+    if is_replay():
+        return get_replay_client()
+    client = _clients.get("spot")
+    if client is None:
+        with _clients_lock:
+            client = _clients.get("spot")
+            if client is None:
+                from binance import Client as Spot
+                client = Spot()
+                _clients["spot"] = client
+    return client
+
+
+def now_ms() -> int:
+    """Hora actual en ms; en modo replay, la hora virtual de la grabación"""
+    if is_replay():
+        return get_replay_client().now_ms()
+    return int(time.time() * 1000)
+
+
+def is_futures_symbol(symbol: str) -> bool:
+    """Determina si un símbolo es de futuros basado en su formato"""
+    try:
+        # Los pares de futuros típicamente terminan en USDT o BUSD
+        return symbol.endswith(('USDT', 'BUSD'))
+    except Exception:
+        return False
+
+
+def get_all_futures_symbols() -> List[str]:
+    """Símbolos de futuros en estado TRADING, cacheados SYMBOLS_CACHE_TTL segundos"""
+    now = time.time()
+    if _symbols_cache["symbols"] and now - _symbols_cache["fetched_at"] < settings.SYMBOLS_CACHE_TTL:
+        return list(_symbols_cache["symbols"])
+
+    with _symbols_lock:
+        if _symbols_cache["symbols"] and now - _symbols_cache["fetched_at"] < settings.SYMBOLS_CACHE_TTL:
+            return list(_symbols_cache["symbols"])
+        try:
+            exchange_info = get_futures_client().exchange_info()
+            symbols = [symbol['symbol'] for symbol in exchange_info['symbols'] if symbol['status'] == 'TRADING']
+        except Exception as e:
+            logger.error(f"Error getting futures symbols: {e}")
+            # Si falla, servir la última lista conocida
+            return list(_symbols_cache["symbols"])
+
+        _symbols_cache["symbols"] = symbols
+        _symbols_cache["fetched_at"] = time.time()
+        return list(symbols)
+
+
+def fetch_coingecko_markets() -> List[Dict]:
+    """Top 100 de CoinGecko por capitalización (usado por /api/top-cryptos)"""
+    import requests
+
+    response = requests.get(
+        COINGECKO_MARKETS_URL,
+        params={
+            "vs_currency": "usd",
+            "order": "market_cap_desc",
+            "per_page": 100,
+            "page": 1,
+            "sparkline": False
+        }
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _download_klines(symbol: str, interval: str, limit: int, **params) -> List:
+    # Determinar qué cliente usar basado en el símbolo
+    futures_client = get_futures_client()
+    spot_client = get_spot_client()
+    client = futures_client if is_futures_symbol(symbol) else spot_client
+
+    try:
+        return client.klines(symbol=symbol, interval=interval, limit=limit, **params)
+    except Exception as e:
+        logger.error(f"Error getting klines for {symbol}: {e}")
+        # Si falla con un cliente, intentar con el otro
+        client = spot_client if client is futures_client else futures_client
+        return client.klines(symbol=symbol, interval=interval, limit=limit, **params)
+
+
+def fetch_klines(symbol: str, interval: str, limit: int = 1000) -> List:
+    """
+    Devuelve las últimas `limit` velas crudas de Binance para (symbol, interval).
+
+    Siempre se descargan KLINES_CACHE_LIMIT velas y se sirven desde memoria
+    mientras tengan menos de KLINES_CACHE_TTL segundos, de modo que peticiones
+    con límites distintos comparten la misma descarga. Se guardan como máximo
+    KLINES_CACHE_MAX_ENTRIES pares (símbolo, intervalo), descartando el menos
+    usado.
+    """
+    key = (symbol, interval)
+    limit = min(limit, settings.KLINES_CACHE_LIMIT)
+
+    with _klines_lock:
+        entry = _klines_cache.get(key)
+        if entry is not None:
+            _klines_cache.move_to_end(key)
+
+    if entry is None or time.time() - entry["fetched_at"] >= settings.KLINES_CACHE_TTL:
+        klines = _download_klines(symbol, interval, settings.KLINES_CACHE_LIMIT)
+        entry = {"klines": klines, "fetched_at": time.time()}
+        with _klines_lock:
+            _klines_cache[key] = entry
+            _klines_cache.move_to_end(key)
+            while len(_klines_cache) > settings.KLINES_CACHE_MAX_ENTRIES:
+                _klines_cache.popitem(last=False)
+
+    return entry["klines"][-limit:]
+
+
+def fetch_recent_klines(symbol: str, interval: str, limit: int) -> List:
+    """
+    Últimas `limit` velas descargadas sin pasar por la caché LRU, para módulos
+    que guardan su propia historia y solo necesitan las velas nuevas.
+    """
+    return _download_klines(symbol, interval, limit)
+
+
+def fetch_klines_range(symbol: str, interval: str, start: int, end: Optional[int] = None) -> List:
+    """
+    Velas con open time entre `start` y `end` (ms). Se descargan en páginas de
+    KLINES_CACHE_LIMIT hacia atrás desde `end` (o desde ahora), de modo que al
+    cortar en KLINES_RANGE_MAX_CANDLES se pierden las más antiguas.
+    """
+    pages: List[List] = []
+    count = 0
+    cursor = end
+    while count < settings.KLINES_RANGE_MAX_CANDLES:
+        params = {} if cursor is None else {"endTime": cursor}
+        page = _download_klines(symbol, interval, settings.KLINES_CACHE_LIMIT, **params)
+        page = [k for k in page if k[0] >= start]
+        if not page:
+            break
+        pages.append(page)
+        count += len(page)
+        if len(page) < settings.KLINES_CACHE_LIMIT:
+            break
+        cursor = page[0][0] - 1
+
+    klines = [k for page in reversed(pages) for k in page]
+    if len(klines) > settings.KLINES_RANGE_MAX_CANDLES:
+        logger.warning(f"Klines range for {symbol} {interval} truncated to the newest {settings.KLINES_RANGE_MAX_CANDLES} candles")
+    return klines[-settings.KLINES_RANGE_MAX_CANDLES:]
+
+
+def fetch_klines_many(symbols: List[str], interval: str, limit: int = 1000) -> Dict[str, List]:
+    """
+    Obtiene las velas de varios símbolos en paralelo (KLINES_FETCH_WORKERS
+    hilos). Los símbolos que fallan se omiten del resultado.
+    """
+    def _fetch(symbol):
+        try:
+            return symbol, fetch_klines(symbol, interval, limit)
+        except Exception as e:
+            logger.error(f"Error getting klines for {symbol}: {e}")
+            return symbol, None
+
+    with ThreadPoolExecutor(max_workers=settings.KLINES_FETCH_WORKERS) as executor:
+        results = executor.map(_fetch, symbols)
+
+    return {symbol: klines for symbol, klines in results if klines}
+
+
+def warmup() -> None:
+    """
+    Precarga el registro de símbolos y las velas de HOT_SYMBOLS para cada
+    intervalo de WARMUP_INTERVALS. Marca el servicio como listo al terminar,
+    aunque alguna descarga falle.
+    """
+    started = time.perf_counter()
+    try:
+        symbols = get_all_futures_symbols()
+        logger.info(f"Warmup: {len(symbols)} futures symbols loaded")
+
+        for interval in split_setting(settings.WARMUP_INTERVALS):
+            for symbol in split_setting(settings.HOT_SYMBOLS):
+                try:
+                    fetch_klines(symbol, interval)
+                except Exception as e:
+                    logger.error(f"Warmup: error loading klines for {symbol} {interval}: {e}")
+    finally:
+        _ready.set()
+        logger.info(f"Warmup finished in {time.perf_counter() - started:.2f}s")
+
+
+def start_warmup() -> None:
+    """Lanza el precalentamiento en segundo plano sin bloquear el arranque"""
+    if not settings.WARMUP_ENABLED:
+        _ready.set()
+        return
+    threading.Thread(target=warmup, name="market-data-warmup", daemon=True).start()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
@@ -0,0 +1,170 @@
+"""
+Resumen de mercado a partir de una única petición bulk de tickers 24h de
+futuros. Ganadores/perdedores, líderes de volumen, amplitud y buckets de
+volatilidad se calculan en una sola pasada vectorizada; un hilo en segundo
+plano refresca el resultado y las peticiones se responden desde memoria,
+indicando su antigüedad (`age_seconds`, `stale`).
+"""
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import get_settings
+from market_data import get_all_futures_symbols, get_futures_client, now_ms
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Bordes de los buckets de volatilidad (rango alto-bajo de 24h en %)
+VOLATILITY_EDGES = [0, 2, 5, 10, 20, np.inf]
+
+_overview: Dict[str, Optional[Dict]] = {"data": None}
+_refresh_lock = threading.Lock()
+_started = False
+
+
+def _top(order: np.ndarray, symbols: np.ndarray, last: np.ndarray,
+         change: np.ndarray, quote_volume: np.ndarray) -> List[Dict]:
+    return [
+        {
+            "symbol": str(symbols[i]),
+            "price": float(last[i]),
+            "priceChangePercent": round(float(change[i]), 2),
+            "quoteVolume": round(float(quote_volume[i]), 2),
+        }
+        for i in order
+    ]
+
+
+def _top_indices(values: np.ndarray, n: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Índices de los `n` mayores valores (solo entre `mask`), ordenados de mayor a menor"""
+    candidates = np.arange(len(values)) if mask is None else np.flatnonzero(mask)
+    n = min(n, len(candidates))
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    idx = candidates[np.argpartition(-values[candidates], n - 1)[:n]]
+    return idx[np.argsort(-values[idx], kind="stable")]
+
+
+def compute_overview(tickers: List[Dict], trading: Optional[set] = None) -> Dict:
+    """Calcula el resumen de mercado a partir de la respuesta de /fapi/v1/ticker/24hr"""
+    if trading:
+        tickers = [t for t in tickers if t["symbol"] in trading]
+
+    n = len(tickers)
+    symbols = np.array([t["symbol"] for t in tickers])
+    data = np.array(
+        [(t["lastPrice"], t["priceChangePercent"], t["quoteVolume"], t["highPrice"], t["lowPrice"])
+         for t in tickers],
+        dtype=np.float64,
+    ).reshape(n, 5)
+    last, change, quote_volume, high, low = data.T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volatility = np.where(low > 0, (high - low) / low * 100, 0.0)
+
+    top_n = settings.MARKET_OVERVIEW_TOP_N
+    advancers = int(np.count_nonzero(change > 0))
+    decliners = int(np.count_nonzero(change < 0))
+    total_volume = float(quote_volume.sum())
+    counts, _ = np.histogram(volatility, bins=VOLATILITY_EDGES)
+
+    return {
+        "updated_at": now_ms(),
+        "symbols": n,
+        "breadth": {
+            "advancers": advancers,
+            "decliners": decliners,
+            "unchanged": n - advancers - decliners,
+            "ratio": round(advancers / decliners, 2) if decliners else None,
+        },
+        "stats": {
+            "medianChangePercent": round(float(np.median(change)), 2) if n else 0.0,
+            "volumeWeightedChangePercent": round(float(change @ quote_volume / total_volume), 2) if total_volume else 0.0,
+            "totalQuoteVolume": round(total_volume, 2),
+        },
+        "top_gainers": _top(_top_indices(change, top_n, change > 0), symbols, last, change, quote_volume),
+        "top_losers": _top(_top_indices(-change, top_n, change < 0), symbols, last, change, quote_volume),
+        "volume_leaders": _top(_top_indices(quote_volume, top_n), symbols, last, change, quote_volume),
+        "volatility_buckets": [
+            {
+                "range": f"{lo:g}-{hi:g}%" if np.isfinite(hi) else f">{lo:g}%",
+                "count": int(count),
+            }
+            for lo, hi, count in zip(VOLATILITY_EDGES[:-1], VOLATILITY_EDGES[1:], counts)
+        ],
+    }
+
+
+def _age_seconds(overview: Dict) -> float:
+    return (now_ms() - overview["updated_at"]) / 1000
+
+
+def _max_age() -> float:
+    # Margen para el tiempo que tarda el propio refresco del hilo
+    return 2 * settings.MARKET_OVERVIEW_REFRESH_SECONDS
+
+
+def refresh(max_age: Optional[float] = None) -> Dict:
+    """
+    Descarga todos los tickers de 24h en una petición y recalcula el resumen.
+    Con `max_age`, si otro hilo lo acaba de recalcular se devuelve ese.
+    """
+    with _refresh_lock:
+        overview = _overview["data"]
+        if max_age is not None and overview is not None and _age_seconds(overview) <= max_age:
+            return overview
+        tickers = get_futures_client().ticker_24hr_price_change()
+        trading = set(get_all_futures_symbols())
+        overview = compute_overview(tickers, trading)
+        _overview["data"] = overview
+        return overview
+
+
+def get_overview(limit: Optional[int] = None) -> Dict:
+    """
+    Resumen desde memoria. Si no existe o está caducado (hilo desactivado o
+    refrescos fallidos) se recalcula aquí; si eso falla se sirve el último
+    conocido con `stale` a True.
+    """
+    overview = _overview["data"]
+    if overview is None or _age_seconds(overview) > _max_age():
+        try:
+            overview = refresh(_max_age())
+        except Exception as e:
+            if overview is None:
+                raise
+            logger.error(f"Error refreshing market overview, serving stale data: {e}")
+
+    age = _age_seconds(overview)
+    overview = dict(overview, age_seconds=round(age, 1), stale=age > _max_age())
+    if limit is None or limit >= settings.MARKET_OVERVIEW_TOP_N:
+        return overview
+    limit = max(limit, 0)
+    return dict(
+        overview,
+        top_gainers=overview["top_gainers"][:limit],
+        top_losers=overview["top_losers"][:limit],
+        volume_leaders=overview["volume_leaders"][:limit],
+    )
+
+
+def _run() -> None:
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing market overview: {e}")
+        time.sleep(settings.MARKET_OVERVIEW_REFRESH_SECONDS)
+
+
+def start() -> None:
+    """Arranca el refresco periódico en segundo plano"""
+    global _started
+    if _started:
+        return
+    _started = True
+    threading.Thread(target=_run, name="market-overview", daemon=True).start()
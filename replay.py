@@ -0,0 +1,181 @@
+"""
+Fuente de datos de replay: sirve datos de mercado grabados con la misma
+interfaz que los clientes de Binance (`klines`, `exchange_info`, `depth`,
+`ticker_24hr_price_change`, `mark_price`, `open_interest`,
+`long_short_account_ratio`), para ejecutar el backend sin conexión.
+
+Estructura del directorio de grabación (REPLAY_DIR):
+
+    exchange_info.json
+    ticker_24hr.json              (opcional)
+    premium_index.json            (opcional)
+    open_interest.json            (opcional, {símbolo: respuesta})
+    long_short_ratio.json         (opcional, {símbolo: respuesta})
+    coingecko_markets.json        (opcional, para /api/top-cryptos)
+    klines/{SYMBOL}_{interval}.json
+    depth/{SYMBOL}.json           (opcional, snapshot de /fapi/v1/depth)
+
+El reloj virtual arranca en REPLAY_START y avanza REPLAY_SPEED veces más
+rápido que el reloj real; con REPLAY_SPEED=0 queda congelado y las respuestas
+son deterministas. Con REPLAY_START=0 arranca cuando cada serie grabada tiene
+ya KLINES_CACHE_LIMIT velas cerradas (o al final de la grabación si es más
+corta). Solo se sirven velas cerradas a la hora virtual: la grabación guarda
+el OHLC final de cada vela y servir la vela en curso adelantaría datos.
+
+Para grabar:
+
+    python replay.py --symbols BTCUSDT,ETHUSDT --intervals 1h,15m --out replay_data
+"""
+import argparse
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class ReplayClient:
+    """Cliente de solo lectura sobre una grabación en disco"""
+
+    def __init__(self, directory: str, speed: float = 1.0, start_ms: int = 0):
+        self.directory = directory
+        self.speed = speed
+        self._lock = threading.Lock()
+        # (símbolo, intervalo) -> (open times, close times, velas)
+        self._klines: Dict[Tuple[str, str], Tuple[List[int], List[int], List]] = {}
+        self._json: Dict[str, object] = {}
+
+        self._start_ms = start_ms or self._default_start()
+        self._wall_start = time.time()
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.directory, *parts)
+
+    def _load_json(self, *parts: str):
+        path = self._path(*parts)
+        with self._lock:
+            if path not in self._json:
+                if not os.path.exists(path):
+                    raise ValueError(f"No hay datos grabados en {path}")
+                with open(path) as f:
+                    self._json[path] = json.load(f)
+            return self._json[path]
+
+    def _default_start(self) -> int:
+        """Primer instante en que todas las series tienen KLINES_CACHE_LIMIT velas cerradas"""
+        klines_dir = self._path("klines")
+        start = None
+        if os.path.isdir(klines_dir):
+            for name in os.listdir(klines_dir):
+                with open(os.path.join(klines_dir, name)) as f:
+                    data = json.load(f)
+                if data:
+                    ready = data[min(len(data), settings.KLINES_CACHE_LIMIT) - 1][6] + 1
+                    start = ready if start is None else max(start, ready)
+        return start or int(time.time() * 1000)
+
+    def now_ms(self) -> int:
+        """Hora virtual del replay en milisegundos"""
+        return self._start_ms + int((time.time() - self._wall_start) * 1000 * self.speed)
+
+    def _series(self, symbol: str, interval: str) -> Tuple[List[int], List[int], List]:
+        key = (symbol, interval)
+        series = self._klines.get(key)
+        if series is None:
+            data = self._load_json("klines", f"{symbol}_{interval}.json")
+            series = ([k[0] for k in data], [k[6] for k in data], data)
+            self._klines[key] = series
+        return series
+
+    def klines(self, symbol: str, interval: str, limit: int = 500,
+               startTime: Optional[int] = None, endTime: Optional[int] = None, **kwargs) -> List:
+        """Velas cerradas antes de la hora virtual (y con open time dentro de startTime/endTime)"""
+        open_times, close_times, data = self._series(symbol, interval)
+        end = bisect.bisect_left(close_times, self.now_ms())
+        if endTime is not None:
+            end = min(end, bisect.bisect_right(open_times, endTime))
+        if startTime is not None:
+            start = bisect.bisect_left(open_times, startTime)
+            return data[start:min(end, start + limit)]
+        return data[max(0, end - limit):end]
+
+    def exchange_info(self) -> Dict:
+        return self._load_json("exchange_info.json")
+
+    def depth(self, symbol: str, limit: int = 1000, **kwargs) -> Dict:
+        snapshot = self._load_json("depth", f"{symbol}.json")
+        return dict(snapshot, bids=snapshot["bids"][:limit], asks=snapshot["asks"][:limit])
+
+    def ticker_24hr_price_change(self, symbol: Optional[str] = None, **kwargs):
+        tickers = self._load_json("ticker_24hr.json")
+        if symbol:
+            return next((t for t in tickers if t["symbol"] == symbol), None)
+        return tickers
+
+    def mark_price(self, symbol: Optional[str] = None, **kwargs):
+        entries = self._load_json("premium_index.json")
+        if symbol:
+            return next((e for e in entries if e["symbol"] == symbol), None)
+        return entries
+
+    def open_interest(self, symbol: str, **kwargs) -> Optional[Dict]:
+        return self._load_json("open_interest.json").get(symbol)
+
+    def long_short_account_ratio(self, symbol: str, period: str, **kwargs) -> List[Dict]:
+        return self._load_json("long_short_ratio.json").get(symbol, [])
+
+    def coingecko_markets(self) -> List[Dict]:
+        return self._load_json("coingecko_markets.json")
+
+
+def record(symbols: List[str], intervals: List[str], out: str, limit: int = 1000) -> None:
+    """Graba en `out` los datos actuales de Binance y CoinGecko en el formato de replay"""
+    from market_data import fetch_coingecko_markets, get_futures_client
+
+    client = get_futures_client()
+    os.makedirs(os.path.join(out, "klines"), exist_ok=True)
+    os.makedirs(os.path.join(out, "depth"), exist_ok=True)
+
+    def _dump(data, *parts):
+        with open(os.path.join(out, *parts), "w") as f:
+            json.dump(data, f)
+
+    _dump(client.exchange_info(), "exchange_info.json")
+    _dump(client.ticker_24hr_price_change(), "ticker_24hr.json")
+    _dump(client.mark_price(), "premium_index.json")
+    try:
+        _dump(fetch_coingecko_markets(), "coingecko_markets.json")
+    except Exception as e:
+        logger.error(f"Error recording CoinGecko markets: {e}")
+    open_interest, long_short = {}, {}
+    for symbol in symbols:
+        for interval in intervals:
+            _dump(client.klines(symbol=symbol, interval=interval, limit=limit), "klines", f"{symbol}_{interval}.json")
+        _dump(client.depth(symbol=symbol, limit=1000), "depth", f"{symbol}.json")
+        open_interest[symbol] = client.open_interest(symbol=symbol)
+        long_short[symbol] = client.long_short_account_ratio(
+            symbol=symbol, period=settings.DERIVATIVES_RATIO_PERIOD, limit=1
+        )
+    _dump(open_interest, "open_interest.json")
+    _dump(long_short, "long_short_ratio.json")
+    logger.info(f"Recorded {len(symbols)} symbols x {len(intervals)} intervals in {out}")
+
+
+if __name__ == "__main__":
+    from market_data import split_setting
+
+    parser = argparse.ArgumentParser(description="Graba datos de Binance para el modo replay")
+    parser.add_argument("--symbols", required=True, help="Símbolos separados por coma")
+    parser.add_argument("--intervals", default="1h", help="Intervalos separados por coma")
+    parser.add_argument("--out", default=settings.REPLAY_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    record(split_setting(args.symbols.upper()), split_setting(args.intervals), args.out)
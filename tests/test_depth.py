@@ -0,0 +1,63 @@
+import os
+import random
+
+import pytest
+
+from depth import BookSide, aggregate_depth, load_recording, replay
+
+RECORDING = os.path.join(os.path.dirname(__file__), "fixtures", "depth_replay.jsonl")
+
+
+def _levels(side):
+    return list(zip(side.prices.tolist(), side.quantities.tolist()))
+
+
+def test_replay_applies_events_after_snapshot():
+    snapshot, events = load_recording(RECORDING)
+    book = replay(snapshot, events, "BTCUSDT")
+
+    # El primer evento (u=99) es anterior al snapshot y se ignora
+    assert book.synced
+    assert book.last_update_id == 108
+    assert book.updated_at == 1700000000400
+    assert _levels(book.bids) == [(97.0, 1.0), (98.0, 4.0), (99.5, 3.0)]
+    assert _levels(book.asks) == [(100.8, 2.0), (101.0, 5.0), (103.0, 1.0)]
+
+
+def test_replay_rejects_sequence_gap():
+    snapshot, events = load_recording(RECORDING)
+    with pytest.raises(ValueError):
+        replay(snapshot, events[:2] + events[3:], "BTCUSDT")
+
+
+def test_replay_rejects_stream_newer_than_snapshot():
+    snapshot, events = load_recording(RECORDING)
+    with pytest.raises(ValueError):
+        replay(snapshot, events[3:], "BTCUSDT")
+
+
+def test_aggregate_depth_buckets_and_walls():
+    snapshot, events = load_recording(RECORDING)
+    book = replay(snapshot, events, "BTCUSDT")
+    depth = aggregate_depth(book, step=1.0, range_pct=5.0, wall_factor=2.0)
+
+    assert depth["best_bid"] == 99.5
+    assert depth["best_ask"] == 100.8
+    assert [(b["price"], b["quantity"]) for b in depth["bids"]] == [(99.0, 3.0), (98.0, 4.0), (97.0, 1.0)]
+    assert [(a["price"], a["quantity"]) for a in depth["asks"]] == [(100.0, 2.0), (101.0, 5.0), (103.0, 1.0)]
+    assert [(w["side"], w["price"]) for w in depth["walls"]] == [("ask", 101.0)]
+
+
+def test_book_side_matches_dict():
+    rng = random.Random(7)
+    side, expected = BookSide(), {}
+    for _ in range(3000):
+        update = [[float(rng.randint(1, 200)), float(rng.choice([0, 0, rng.randint(1, 50)]))]
+                  for _ in range(rng.randint(1, 5))]
+        side.apply(update)
+        for price, quantity in update:
+            if quantity:
+                expected[price] = quantity
+            else:
+                expected.pop(price, None)
+        assert _levels(side) == sorted(expected.items())
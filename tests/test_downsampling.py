@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+import downsampling
+import market_data
+from downsampling import CLOSE, CLOSE_TIME, HIGH, LOW, OPEN, TIME, TRADES, VOLUME, lttb, ohlc_buckets
+
+MINUTE = 60_000
+
+
+def _candles(n: int, seed: int = 0, first: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=n))
+    data = np.zeros((n, 11))
+    data[:, TIME] = first + np.arange(n) * MINUTE
+    data[:, OPEN] = close - rng.random(n)
+    data[:, HIGH] = close + rng.random(n) + 1
+    data[:, LOW] = close - rng.random(n) - 1
+    data[:, CLOSE] = close
+    data[:, VOLUME] = rng.random(n) * 10
+    data[:, CLOSE_TIME] = data[:, TIME] + MINUTE - 1
+    data[:, TRADES] = rng.integers(1, 100, n)
+    return data
+
+
+def _lttb_reference(x, y, threshold):
+    """Implementación de referencia de LTTB (Steinarsson), punto a punto"""
+    n = len(x)
+    every = (n - 2) / (threshold - 2)
+    selected, a = [0], 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        avg_x = sum(x[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(y[next_start:next_end]) / (next_end - next_start)
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def test_ohlc_buckets_keep_extremes_and_totals():
+    data = _candles(1000)
+    out = ohlc_buckets(data, 100)
+
+    assert len(out) == 100
+    buckets = data.reshape(100, 10, 11)
+    assert np.array_equal(out[:, TIME], buckets[:, 0, TIME])
+    assert np.array_equal(out[:, OPEN], buckets[:, 0, OPEN])
+    assert np.array_equal(out[:, CLOSE], buckets[:, -1, CLOSE])
+    assert np.array_equal(out[:, CLOSE_TIME], buckets[:, -1, CLOSE_TIME])
+    assert np.array_equal(out[:, HIGH], buckets[:, :, HIGH].max(axis=1))
+    assert np.array_equal(out[:, LOW], buckets[:, :, LOW].min(axis=1))
+    assert np.allclose(out[:, VOLUME], buckets[:, :, VOLUME].sum(axis=1))
+    assert out[:, TRADES].sum() == data[:, TRADES].sum()
+
+
+def test_ohlc_buckets_short_series_unchanged():
+    data = _candles(50)
+    assert ohlc_buckets(data, 100) is data
+
+
+@pytest.mark.parametrize("n, threshold", [(1000, 100), (997, 50), (10, 3)])
+def test_lttb_matches_reference(n, threshold):
+    data = _candles(n, seed=n)
+    x, y = data[:, TIME], data[:, CLOSE]
+    assert lttb(x, y, threshold).tolist() == _lttb_reference(x.tolist(), y.tolist(), threshold)
+
+
+def test_open_range_keeps_newest_candles_and_fetches_only_the_tail(monkeypatch):
+    now = 200_000 * MINUTE
+    series = _candles(200_000)
+    calls = []
+
+    def download(symbol, interval, limit, endTime=None, **params):
+        calls.append(endTime)
+        end = len(series) if endTime is None else int(np.searchsorted(series[:, TIME], endTime, side="right"))
+        return series[max(0, end - limit):end].tolist()
+
+    monkeypatch.setattr(market_data, "_download_klines", download)
+    monkeypatch.setattr(downsampling, "now_ms", lambda: now)
+    monkeypatch.setattr(downsampling, "_cache", type(downsampling._cache)())
+    monkeypatch.setattr(downsampling, "_history", type(downsampling._history)())
+
+    # 150000 velas pedidas: se descartan las más antiguas, nunca las recientes
+    start = now - 150_000 * MINUTE
+    rows = downsampling.get_downsampled_klines("BTCUSDT", "1m", 500, "ohlc", start + 1)
+    assert rows[-1][CLOSE_TIME] == series[-1, CLOSE_TIME]
+    assert rows[0][TIME] == now - market_data.settings.KLINES_RANGE_MAX_CANDLES * MINUTE
+
+    # Un start casi igual se sirve del mismo historial con una sola descarga
+    calls.clear()
+    downsampling.get_downsampled_klines("BTCUSDT", "1m", 500, "ohlc", start + 2)
+    assert calls == [None]